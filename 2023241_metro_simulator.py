@@ -2,6 +2,35 @@
 # Bidirectional metro arrival calculator.
 # Produces next arrivals for BOTH directions (start->end and end->start).
 
+import argparse
+import asyncio
+import cProfile
+import csv
+import functools
+import hashlib
+import heapq
+import io
+import json
+import mmap
+import os
+import pstats
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from itertools import accumulate, chain, islice, product
+from types import MappingProxyType
+from urllib.parse import parse_qs, urlsplit
+
 def metro_timing_module():
     main_timing()
 
@@ -11,11 +40,6 @@ METRO_FILE = "metro_data.txt"
 START_TIME_HHMM = (6, 0)   # 06:00
 END_TIME_HHMM   = (23, 0)  # 23:00
 
-# metro frequency periods and timing
-PEAK_PERIODS = [((8,0),(10,0)), ((17,0),(19,0))]
-PEAK_FREQ_MIN = 4
-OFFPEAK_FREQ_MIN = 8
-
 # Convert an (hour, minute) tuple into "minutes since midnight"
 def hhmm_to_minutes(hhmm):
     h, m = hhmm
@@ -24,7 +48,7 @@ def hhmm_to_minutes(hhmm):
 # Convert minutes since midnight into 'HH:MM' 24-hour formatted string.
 # Keeps values wrapped inside 24-hour limit using modulus.
 def minutes_to_hhmm_str(total_min):
-    total_min = total_min % (24*60)
+    total_min = int(round(total_min)) % (24*60)
     h = total_min // 60
     m = total_min % 60
     return f"{h:02d}:{m:02d}"
@@ -40,125 +64,6 @@ def time_str_to_minutes(s):
     m = int(parts[1])
     return h * 60 + m
 
-# Return True if a given minute-of-day lies inside any defined peak interval.
-def in_peak(min_of_day):
-    for (sh, sm), (eh, em) in PEAK_PERIODS:
-        start = hhmm_to_minutes((sh, sm))
-        end   = hhmm_to_minutes((eh, em))
-        if start <= min_of_day < end:
-            return True
-    return False
-
-
-# Build and return a sorted list of departure times (in minutes since midnight) for trains departing from a terminal during the day, based on the peak/off-peak frequency rules and the global start/end times.
-def build_departure_schedule():
-    schedule = []
-    cur = hhmm_to_minutes(START_TIME_HHMM)
-    end = hhmm_to_minutes(END_TIME_HHMM)
-    while cur <= end:
-        schedule.append(cur)
-        freq = PEAK_FREQ_MIN if in_peak(cur) else OFFPEAK_FREQ_MIN
-        cur += freq
-    return schedule
-
-
-# Parse the metro data text file and return: lines, graph and station_index
-def parse_metro_file(path):
-    lines = {}
-    current_section = None
-    with open(path, 'r', encoding='utf-8') as f:
-        for raw in f:
-            line = raw.strip()
-            if not line:
-                continue
-            # Section header
-            if line.startswith('[') and line.endswith(']'):
-                current_section = line[1:-1].strip()
-                lines[current_section] = {
-                    'header': current_section,
-                    'info': {},
-                    'stations': []  # (station_name, time_to_next)
-                }
-                continue
-
-            if current_section is None:
-                # ignore lines before any section
-                continue
-
-            # Info lines like: Info: Start_Point=Dwarka Sector 21
-            if line.startswith('Info:'):
-                try:
-                    _, rest = line.split(':',1)
-                    k, v = rest.strip().split('=',1)
-                    lines[current_section]['info'][k.strip()] = v.strip()
-                except:
-                    pass
-                continue
-            
-            # Skip format header lines like: "Format: Station Name | Approx Time to Next | ..."
-            if line.lower().startswith("format:"):
-                continue
-            
-            # Station data lines - split by '|' and take first two fields (name, time_to_next)
-            if '|' in line:
-                parts = [p.strip() for p in line.split('|')]
-                if len(parts) >= 2:
-                    station_name = parts[0]
-                    try:
-                        time_to_next = int(parts[1])
-                    except:
-                        time_to_next = 0
-                    lines[current_section]['stations'].append((station_name, time_to_next))
-    # build offsets from start and from end
-    for sec, data in lines.items():
-        offsets_start = []
-        cum = 0
-        for (st, t) in data['stations']:
-            offsets_start.append((st, cum))
-            cum += t
-        data['station_offsets_from_start'] = offsets_start
-        # offsets from end: compute distances measured from final station as 0
-        offsets_end = []
-        # total length:
-        total = sum(t for _, t in data['stations'])
-        # For each station, offset_from_end = total - offset_from_start
-        for st, off in offsets_start:
-            off_from_end = total - off
-            offsets_end.append((st, off_from_end))
-        data['station_offsets_from_end'] = offsets_end
-        # store start and end station names
-        if data['stations']:
-            data['line_start'] = data['stations'][0][0]
-            data['line_end']   = data['stations'][-1][0]
-        else:
-            data['line_start'] = data['line_end'] = None
-
-    print("LOADED LINES:", list(lines.keys()))
-
-    return lines
-
-
-def levenshtein(a, b):
-    """Compute Levenshtein distance between strings a and b."""
-    # Used to allow small-typo matching (e.g., 'voilet' -> 'violet').
-    a = a or ""
-    b = b or ""
-    n, m = len(a), len(b)
-    if n == 0: return m
-    if m == 0: return n
-    # create 2 rows only to save memory
-    prev = list(range(m+1))
-    cur  = [0] * (m+1)
-    for i in range(1, n+1):
-        cur[0] = i
-        ai = a[i-1]
-        for j in range(1, m+1):
-            cost = 0 if ai == b[j-1] else 1
-            cur[j] = min(prev[j] + 1,        # deletion
-                         cur[j-1] + 1,      # insertion
-                         prev[j-1] + cost)  # substitution
-        prev, cur = cur, prev
-    return prev[m]
 
 def normalize_string(s):
     # lower, strip punctuation-ish chars, collapse spaces for better comparison
@@ -169,37 +74,23 @@ def find_best_line_match(lines_dict, user_line_input):
     if not u:
         return None
 
-    # 1) exact case-insensitive match
-    for key in lines_dict:
-        if u.lower() == key.lower():
+    # 1) exact match, then 2) starts-with / substring match, all from the prebuilt index
+    index = get_name_index(lines_dict)
+    hits = search_names(index, u, limit=1, max_edits=3)
+    if hits and hits[0][1] != 'fuzzy':
+        return hits[0][0]
+
+    # 2b) the input contains a whole line name, e.g. 'magenta line metro'
+    u_key = search_key(u)
+    for key, key_norm in zip(index.names, index.keys):
+        if key_norm and key_norm in u_key:
             return key
 
-    # 2) substring match (case-insensitive)
-    substr_matches = [k for k in lines_dict if u.lower() in k.lower() or k.lower() in u.lower()]
-    if len(substr_matches) == 1:
-        return substr_matches[0]
-    if len(substr_matches) > 1:
-        # prefer startswith or the shortest name
-        for k in substr_matches:
-            if k.lower().startswith(u.lower()):
-                return k
-        return substr_matches[0]
-
-    # 3) fuzzy match using normalized Levenshtein distance
-    u_norm = normalize_string(u)
-    best_key = None
-    best_dist = None
-    for key in lines_dict:
-        key_norm = normalize_string(key)
-        d = levenshtein(u_norm, key_norm)
-        if best_dist is None or d < best_dist:
-            best_dist = d
-            best_key = key
-
-    # Decide threshold: accept only if distance is reasonably small relative to length
-    if best_dist is not None:
+    # 3) fuzzy match using Levenshtein distance (at most 3 edits)
+    if hits:
+        best_key, _, best_dist = hits[0]
         # threshold example: allow up to 30% of the length (rounded) or at most 3 edits
-        max_allowed = max(1, min(3, len(normalize_string(best_key)) // 3))
+        max_allowed = max(1, min(3, len(search_key(best_key)) // 3))
         if best_dist <= max_allowed:
             return best_key
 
@@ -208,58 +99,32 @@ def find_best_line_match(lines_dict, user_line_input):
 
 
 def find_station_offsets(line_data, station_name):
-    sname = station_name.strip().lower()
-    # exact match first
-    for st, off in line_data['station_offsets_from_start']:
-        if sname == st.lower():
-            # find corresponding offsets from end too
-            off_end = next((oe for s2, oe in line_data['station_offsets_from_end'] if s2 == st), None)
-            return (off, off_end, st)
-    # partial match
-    candidates = []
-    for st, off in line_data['station_offsets_from_start']:
-        if sname in st.lower():
-            off_end = next((oe for s2, oe in line_data['station_offsets_from_end'] if s2 == st), None)
-            candidates.append((off, off_end, st))
-    if candidates:
-        # prefer startswith
-        for off, off_end, st in candidates:
-            if st.lower().startswith(sname):
-                return (off, off_end, st)
-        return candidates[0]
-    return (None, None, None)
-
-def compute_next_arrivals(departures_from_endpoint, station_offset, current_min, max_results=6):
-
-#     Given a series of departure times (minutes since midnight) from an endpoint,
-#     compute the next arrival times at the station (arrival = departure + station_offset).
-#     Filters arrivals outside operating hours and returns up to max_results upcoming arrivals.
-
-    arrivals = []
-    end_day = hhmm_to_minutes(END_TIME_HHMM)
-    for dep in departures_from_endpoint:
-        arr_time = dep + station_offset
-        if arr_time < hhmm_to_minutes(START_TIME_HHMM):
-            continue
-        if arr_time > end_day:
-            continue
-        if arr_time >= current_min:
-            arrivals.append(arr_time)
-            if len(arrivals) >= max_results:
-                break
-    return arrivals
+    # exact match first, then starts-with, then any partial match
+    hits = search_names(get_name_index(line_data.names), station_name, limit=1, max_edits=0)
+    if not hits:
+        return (None, None, None)
+    i = line_data.index[hits[0][0]]
+    return (line_data.offsets_from_start[i], line_data.offsets_from_end[i], line_data.names[i])
 
-def shift_schedule_for_endpoint(departure_schedule, endpoint_offset=0):
+def compute_next_arrivals(departures_from_endpoint, station_offset, current_min, max_results=6, config=None):
 
-    # If departures are generated as minutes-of-day when trains leave "line start"
-    # and we want departures from the END endpoint we can treat each depot as having
-    # its own departure schedule. Simpler: build identical schedule for both endpoints.
-    # For now we return a copy (they are departures measured from 00:00 of day).
+#     Given a sorted series of departure times (minutes since midnight) from an endpoint,
+#     compute the next arrival times at the station (arrival = departure + station_offset).
+#     Filters arrivals outside operating hours and returns up to max_results upcoming arrivals.
+#     Both bounds are found by binary search, so the result is a single slice.
+#     Service hours come from config (a ServiceConfig) when given.
 
-    return list(departure_schedule)
+    start_hhmm, end_hhmm = (config.start, config.end) if config else (START_TIME_HHMM, END_TIME_HHMM)
+    first = max(current_min, hhmm_to_minutes(start_hhmm))
+    end_day = hhmm_to_minutes(end_hhmm)
+    lo = bisect_left(departures_from_endpoint, first - station_offset)
+    hi = bisect_right(departures_from_endpoint, end_day - station_offset)
+    hi = min(hi, lo + max_results)
+    return [dep + station_offset for dep in departures_from_endpoint[lo:hi]]
 
 def main_timing():
-    lines = parse_metro_file(METRO_FILE)
+    lines = refresh_network()[0].lines
+    print("LOADED LINES:", list(lines.keys()))
     if not lines:
         print("Couldn't parse metro file or file is empty.")
         return
@@ -277,7 +142,7 @@ def main_timing():
     off_start, off_end, station_realname = find_station_offsets(line_data, user_station)
     if off_start is None:
         print("Station not found on line. Available (sample):")
-        for st, _ in line_data['station_offsets_from_start'][:20]:
+        for st in line_data.names[:20]:
             print(" -", st)
         return
 
@@ -289,8 +154,8 @@ def main_timing():
         print("Invalid time format.")
         return
 
-    start_min = hhmm_to_minutes(START_TIME_HHMM)
-    end_min = hhmm_to_minutes(END_TIME_HHMM)
+    # this line's own first and last trains (START/END_TIME_HHMM unless its Info overrides them)
+    start_min, end_min = service_window([line_data])
     if current_min > end_min:
         print("No more metros today (after end time).")
         return
@@ -298,39 +163,23 @@ def main_timing():
         print(f"Service hasn't started. First trains at {minutes_to_hhmm_str(start_min)}.")
         current_min = start_min
 
-    departures = build_departure_schedule()
-    # For both endpoints we just use same schedule of departures (trains start regularly from both ends)
-    departures_from_start = shift_schedule_for_endpoint(departures)
-    departures_from_end   = shift_schedule_for_endpoint(departures)
-
-    # For 'start -> end', station arrival = departure_from_start + offset_from_start
-    arrivals_forward = compute_next_arrivals(departures_from_start, off_start, current_min, max_results=6)
-    # For 'end -> start', station arrival = departure_from_end + offset_from_end
-    # but note offset_from_end was computed as (total - offset_from_start). To get correct arrival
-    # when a train departs the END at minute D, arrival_time = D + offset_from_end_distance_from_end_to_station.
-    arrivals_reverse = compute_next_arrivals(departures_from_end, off_end, current_min, max_results=6)
+    print(format_station_arrivals(station_arrivals(line_data, station_realname, current_min)))
 
+# Text for a StationArrivals result, as printed by the timing module.
+def format_station_arrivals(result):
     # Direction labels using line endpoints
-    dir_to_end_label = f"towards {line_data.get('line_end','END')}"
-    dir_to_start_label = f"towards {line_data.get('line_start','START')}"
-
-    print()
-    print(f"Line: {chosen_line_key}")
-    print(f"Station: {station_realname}")
-    print(f"Current time: {minutes_to_hhmm_str(current_min)}")
-    print()
-
-    if arrivals_forward:
-        print(f"Trains {dir_to_end_label}:")
-        print("  " + ", ".join(minutes_to_hhmm_str(a) for a in arrivals_forward))
-    else:
-        print(f"No more trains {dir_to_end_label} today.")
-
-    if arrivals_reverse:
-        print(f"\nTrains {dir_to_start_label}:")
-        print("  " + ", ".join(minutes_to_hhmm_str(a) for a in arrivals_reverse))
-    else:
-        print(f"\nNo more trains {dir_to_start_label} today.")
+    dir_to_end_label = f"towards {result.towards_end.terminal or 'END'}"
+    dir_to_start_label = f"towards {result.towards_start.terminal or 'START'}"
+    out = ["", f"Line: {result.line}", f"Station: {result.station}",
+           f"Current time: {minutes_to_hhmm_str(result.time)}", ""]
+    for label, arrivals, sep in ((dir_to_end_label, result.towards_end.arrivals, ""),
+                                 (dir_to_start_label, result.towards_start.arrivals, "\n")):
+        if arrivals:
+            out.append(f"{sep}Trains {label}:")
+            out.append("  " + ", ".join(minutes_to_hhmm_str(a) for a in arrivals))
+        else:
+            out.append(f"{sep}No more trains {label} today.")
+    return "\n".join(out)
 
 
 
@@ -351,6 +200,21 @@ END_SERVICE = (23,0)
 PEAK_PERIODS = [((8,0),(10,0)), ((17,0),(19,0))]
 PEAK_FREQ = 4
 OFFPEAK_FREQ = 8
+DAY_TYPES = ('weekday', 'weekend')
+SERVICE_DAY = 'weekday'
+
+# The constants above are the defaults. Schedule, planner and simulation functions take
+# an optional config=ServiceConfig(...) instead, so scenarios with different headways or
+# timings can run side by side (e.g. in worker processes) without touching globals.
+# Lines may override the service hours and headways in the data file (see line_service);
+# day selects which of their profiles applies.
+ServiceConfig = namedtuple('ServiceConfig', 'start end peak_periods peak_freq offpeak_freq dwell interchange day')
+
+def current_config():
+    """ServiceConfig built from the module-level defaults."""
+    return ServiceConfig(tuple(START_SERVICE), tuple(END_SERVICE),
+                         tuple((tuple(a), tuple(b)) for a, b in PEAK_PERIODS),
+                         PEAK_FREQ, OFFPEAK_FREQ, DWELL_TIME, INTERCHANGE_TIME, SERVICE_DAY)
 
 # -------------------- time helpers --------------------
 def hhmm_to_min(hm): return hm[0]*60 + hm[1]
@@ -364,8 +228,8 @@ def time_str_to_min(s):
     if ':' not in s: raise ValueError("Time must be HH:MM")
     a,b = s.split(':'); return int(a)*60 + int(b)
 
-def in_peak(x):
-    for (sh,sm),(eh,em) in PEAK_PERIODS:
+def in_peak(x, config=None):
+    for (sh,sm),(eh,em) in (config.peak_periods if config else PEAK_PERIODS):
         if hhmm_to_min((sh,sm)) <= x < hhmm_to_min((eh,em)): return True
     return False
 
@@ -381,93 +245,776 @@ def min_to_ampm(m):
     return f"{h12:02d}:{mm:02d} {suffix}"
 
 
-# -------------------- parse metro file (reads distance field) --------------------
-def parse_metro_file2(path):
-    lines = {}
+# -------------------- network loader --------------------
+# One pass over the data file builds an immutable network shared by every module:
+#   Station      - one row of the file (namedtuple, so no per-record __dict__)
+#   MetroLine    - a [LINE] section with its stations plus precomputed columns:
+#                  names, name -> position index, cumulative time offsets from each
+#                  end and cumulative distance from the start (all tuples)
+#   MetroNetwork - read-only {line_key: MetroLine} plus station -> line keys index,
+#                  station -> StationMeta (layout, parking, first line, distance column)
+#                  and line_key -> digest of its section text (for incremental reloads),
+#                  plus the resolved Interchanges (see build_interchanges)
+Station = namedtuple('Station', 'name time interchange layout parking distance')
+MetroLine = namedtuple('MetroLine', 'key info stations names index offsets_from_start '
+                                    'offsets_from_end cum_distance total_length line_start line_end')
+MetroNetwork = namedtuple('MetroNetwork', 'path lines station_index station_meta sections interchanges')
+StationMeta = namedtuple('StationMeta', 'layout parking line distance')
+
+def parse_station_row(line):
+    parts = [p.strip() for p in line.split('|')]
+    # Expect 6 parts: name, time, interchange, layout, parking, distance
+    while len(parts) < 6: parts.append('-')
+    try: tnext = float(parts[1])
+    except: tnext = 0.0
+    # distance (km) to the next station
+    try:
+        dist = float(parts[5]) if parts[5] not in ('-', '') else 0.0
+    except:
+        dist = 0.0
+    return Station(parts[0], tnext, parts[2] or '-', parts[3] or '-', parts[4] or '-', dist)
+
+def build_metro_line(key, info, stations):
+    stations = tuple(stations)
+    offsets = []
+    cum_dist = []
+    cum = 0.0
+    km = 0.0
+    for s in stations:
+        offsets.append(cum)
+        cum_dist.append(km)
+        cum += s.time
+        km += s.distance
+    return assemble_metro_line(key, info, stations, offsets, cum_dist, cum)
+
+def assemble_metro_line(key, info, stations, offsets, cum_distance, total):
+    """MetroLine from its stations and precomputed columns; shared by the text and
+    compiled loaders so both build lines the same way."""
+    names = tuple(s.name for s in stations)
+    return MetroLine(
+        key=key,
+        info=MappingProxyType(dict(info)),
+        stations=tuple(stations),
+        names=names,
+        index=MappingProxyType({n: i for i, n in reversed(list(enumerate(names)))}),
+        offsets_from_start=tuple(offsets),
+        # offset_from_end = total - offset_from_start
+        offsets_from_end=tuple(total - off for off in offsets),
+        cum_distance=tuple(cum_distance),
+        total_length=total,
+        line_start=names[0] if names else None,
+        line_end=names[-1] if names else None,
+    )
+
+def split_sections(f):
+    """{line_key: (stripped non-blank lines of the section, ...)} in file order."""
+    sections = {}
     cur = None
+    for raw in f:
+        line = raw.strip()
+        if not line: continue
+        # Section header
+        if line.startswith('[') and line.endswith(']'):
+            cur = line[1:-1].strip()
+            sections[cur] = []
+            continue
+        # ignore lines before any section
+        if cur is None: continue
+        sections[cur].append(line)
+    return {key: tuple(body) for key, body in sections.items()}
+
+def section_digest(body):
+    return hashlib.sha1("\n".join(body).encode('utf-8')).hexdigest()
+
+def parse_section(key, body):
+    info = {}
+    stations = []
+    for line in body:
+        # Info lines like: Info: Start_Point=Dwarka Sector 21
+        if line.lower().startswith('info:'):
+            try:
+                _, rest = line.split(':',1)
+                k,v = rest.strip().split('=',1)
+                info[k.strip()] = v.strip()
+            except: pass
+            continue
+        if line.lower().startswith('format:'): continue
+        if '|' in line:
+            stations.append(parse_station_row(line))
+    return build_metro_line(key, info, stations)
+
+def load_network(path, previous=None):
+    """Parse the data file. With previous (an earlier network from the same file), lines
+    whose section text is unchanged are reused as-is, so only edited sections are parsed
+    and everything keyed on those MetroLine objects stays valid."""
     with open(path, 'r', encoding='utf-8') as f:
-        for raw in f:
-            line = raw.strip()
-            if not line: continue
-            if line.startswith('[') and line.endswith(']'):
-                cur = line[1:-1].strip()
-                lines[cur] = {'stations': [], 'info': {}}
+        sections = split_sections(f)
+    lines = {}
+    digests = {}
+    for key, body in sections.items():
+        digests[key] = section_digest(body)
+        if previous is not None and previous.sections.get(key) == digests[key]:
+            lines[key] = previous.lines[key]
+        else:
+            lines[key] = parse_section(key, body)
+    return assemble_network(path, lines, digests)
+
+def assemble_network(path, lines, digests):
+    """MetroNetwork from {line_key: MetroLine} (in file order) and section digests."""
+    station_index = {}
+    station_meta = {}
+    parking = {}        # few distinct tokens; normalize each once
+    for key, line in lines.items():
+        for s in line.stations:
+            keys = station_index.get(s.name)
+            if keys is None:
+                # metadata comes from the first line listing the station
+                station_index[s.name] = [key]
+                p = parking.get(s.parking)
+                if p is None:
+                    p = parking[s.parking] = normalize_parking(s.parking)
+                station_meta[s.name] = StationMeta(s.layout, p, key, s.distance)
+            elif keys[-1] != key:
+                keys.append(key)
+    station_index = MappingProxyType({n: tuple(k) for n, k in station_index.items()})
+    return MetroNetwork(path, MappingProxyType(lines), station_index, MappingProxyType(station_meta),
+                        MappingProxyType(digests), build_interchanges(lines, station_index))
+
+# -------------------- interchanges --------------------
+# Lines meet where they list a station of the same name; the Interchange column says in
+# free text which other lines stop there ('Pink Line', 'Blue Branch Interchange', comma
+# separated lists). Both are resolved once, when a network is assembled:
+#   lines    - station -> keys of the lines serving it, for stations on two or more
+#   tokens   - (line_key, station) -> line keys its Interchange column names
+#   walk     - station -> minutes to change trains there, from Interchange_Time Info
+#              keys ('Kashmere Gate:5, Rajiv Chowk:4'); elsewhere config.interchange
+#   warnings - what did not fit: names matching no line in the file (lines outside the
+#              network, typos), named lines that do not stop at the station, pairs of
+#              lines sharing a station that neither one's column names (a transfer
+#              edge the data does not back up), walking times that do not parse, are
+#              set twice or are for no interchange
+# A name matches the lines whose key has all of its words, ignoring 'line' and
+# 'interchange'; of several, the ones that stop at the station win.
+Interchanges = namedtuple('Interchanges', 'lines tokens walk warnings')
+INTERCHANGE_FILLER = frozenset(('line', 'interchange'))
+
+def _line_words(name):
+    return frozenset(search_key(name).split()) - INTERCHANGE_FILLER
+
+def _parse_walk_times(text):
+    """{station: minutes} from 'Station:minutes, ...'."""
+    walk = {}
+    for part in text.split(','):
+        name, minutes = part.rsplit(':', 1)
+        minutes = float(minutes)
+        if minutes < 0:
+            raise ValueError("walking time must not be negative")
+        walk[name.strip()] = int(minutes) if minutes.is_integer() else minutes
+    return walk
+
+def build_interchanges(lines, station_index):
+    warnings = []
+    shared = {st: keys for st, keys in station_index.items() if len(keys) > 1}
+    words = {key: _line_words(key) for key in lines}
+    matches = {}        # few distinct names; match each once
+    tokens = {}
+    walk = {}
+    for key, line in lines.items():
+        for s in line.stations:
+            if s.interchange in ('-', ''):
                 continue
-            if cur is None: continue
-            if line.lower().startswith('info:'):
-                try:
-                    _, rest = line.split(':',1)
-                    k,v = rest.strip().split('=',1)
-                    lines[cur]['info'][k.strip()] = v.strip()
-                except: pass
+            resolved = []
+            for name in s.interchange.replace(';', ',').split(','):
+                name = name.strip()
+                if not name or name == '-':
+                    continue
+                found = matches.get(name)
+                if found is None:
+                    w = _line_words(name)
+                    found = matches[name] = frozenset(k for k in lines if w and w <= words[k])
+                if not found:
+                    warnings.append(f"{key}: {s.name} lists '{name}', which is no line in the data file")
+                    continue
+                serving = [k for k in station_index[s.name] if k in found]
+                if not serving:
+                    warnings.append(f"{key}: {s.name} lists '{name}', but {' / '.join(sorted(found))} "
+                                    f"does not stop at {s.name}")
+                resolved.extend(k for k in serving if k != key and k not in resolved)
+            tokens[(key, s.name)] = tuple(resolved)
+        text = line.info.get('Interchange_Time')
+        if text:
+            try:
+                times = _parse_walk_times(text)
+            except ValueError:
+                warnings.append(f"{key}: Interchange_Time '{text}' is not 'Station:minutes, ...'")
                 continue
-            if line.lower().startswith('format:'): continue
-            if '|' in line:
-                parts = [p.strip() for p in line.split('|')]
-                # Expect at least 6 parts now: name, time, interchange, layout, parking, distance
-                while len(parts) < 6: parts.append('-')
-                name = parts[0]
-                try: tnext = float(parts[1])
-                except: tnext = 0.0
-                inter = parts[2] if parts[2] else '-'
-                layout = parts[3] if parts[3] else '-'
-                parking = parts[4] if parts[4] else '-'
-                # distance (km)
-                try:
-                    dist = float(parts[5]) if parts[5] not in ('-', '') else 0.0
-                except:
-                    dist = 0.0
-                lines[cur]['stations'].append({
-                    'name': name,
-                    'time': tnext,
-                    'interchange': inter,
-                    'layout': layout,
-                    'parking': parking,
-                    'distance': dist
-                })
-    # build quick lookup index and offsets
-    station_index = {}
-    for lname, data in lines.items():
-        cum = 0.0
-        offsets = {}
-        for s in data['stations']:
-            station_index.setdefault(s['name'], []).append(lname)
-            offsets[s['name']] = cum
-            cum += s['time']
-        data['offsets_from_start'] = offsets
-        data['total_length'] = cum
-    return lines, station_index
+            for st, minutes in times.items():
+                if st not in shared:
+                    warnings.append(f"{key}: Interchange_Time for {st}, which is no interchange")
+                elif walk.get(st, minutes) != minutes:
+                    warnings.append(f"{key}: Interchange_Time for {st} conflicts with another "
+                                    f"line's; using the longer")
+                    walk[st] = max(walk[st], minutes)
+                else:
+                    walk[st] = minutes
+    for st, keys in shared.items():
+        for i, a in enumerate(keys):
+            for b in keys[i + 1:]:
+                if b not in tokens.get((a, st), ()) and a not in tokens.get((b, st), ()):
+                    warnings.append(f"{st}: {a} and {b} both stop here, but neither lists the other "
+                                    f"as an interchange")
+    return Interchanges(MappingProxyType(shared), MappingProxyType(tokens),
+                        MappingProxyType(walk), tuple(warnings))
+
+def transfer_minutes(network, station, config=None):
+    """Minutes to change trains at a station."""
+    walk = network.interchanges.walk.get(station)
+    return walk if walk is not None else (config or current_config()).interchange
+
+def warnings_note(network):
+    n = len(network.interchanges.warnings)
+    return f"{n} data warning{'' if n == 1 else 's'} in {network.path} (see the check command)" if n else ""
+
+def main_check(path=None):
+    """List the interchanges of the data file and its data warnings; 1 if there are any."""
+    network = read_network(path or METRO_FILE)
+    config = current_config()
+    ic = network.interchanges
+    print(f"{len(network.lines)} lines, {len(network.station_index)} stations, {len(ic.lines)} interchanges")
+    for st, keys in ic.lines.items():
+        print(f"  {st}: {', '.join(keys)} ({transfer_minutes(network, st, config):g} min to change)")
+        for key in keys:
+            named = ic.tokens.get((key, st))
+            if named:
+                print(f"    {key} lists {', '.join(named)}")
+    if ic.warnings:
+        print(f"{len(ic.warnings)} warnings:")
+        for w in ic.warnings:
+            print(f"  {w}")
+    return 1 if ic.warnings else 0
+
+# -------------------- compiled network file --------------------
+# The parsed text as flat columns: struct header, interned UTF-8 string table (names,
+# interchange/layout/parking tokens, Info keys and values), then uint32 and float64 arrays,
+# each 8-byte aligned. Loading memory-maps the file and copies whole columns, so there is
+# no per-row splitting or float conversion. The header records the SHA-256 of the text it
+# was compiled from; read_network() only uses a file whose digest still matches.
+NETWORK_BINARY_MAGIC = b"DMNB"
+NETWORK_BINARY_VERSION = 1
+# magic, version, source sha256, strings, string blob bytes, lines, info pairs, stations
+NETWORK_BINARY_HEADER = struct.Struct("<4sI32sIIIII")
+LINE_ROW = 6        # key, first info pair, info pairs, first station, stations, section digest
+STATION_STRS = 4    # name, interchange, layout, parking (string ids)
+STATION_NUMS = 4    # time to next, distance to next, offset from start, cumulative km
+
+def network_binary_path(path):
+    return os.path.splitext(path)[0] + ".bin"
+
+def save_network_binary(network, path, digest):
+    strings = {}
+    def sid(s):
+        i = strings.get(s)
+        if i is None:
+            i = strings[s] = len(strings)
+        return i
+    line_rows, info_rows, station_strs = array('I'), array('I'), array('I')
+    station_nums, totals = array('d'), array('d')
+    for key, line in network.lines.items():
+        line_rows.extend((sid(key), len(info_rows) // 2, len(line.info),
+                          len(station_strs) // STATION_STRS, len(line.stations), sid(network.sections[key])))
+        for k, v in line.info.items():
+            info_rows.extend((sid(k), sid(v)))
+        for s, off, km in zip(line.stations, line.offsets_from_start, line.cum_distance):
+            station_strs.extend((sid(s.name), sid(s.interchange), sid(s.layout), sid(s.parking)))
+            station_nums.extend((s.time, s.distance, off, km))
+        totals.append(line.total_length)
+    encoded = [s.encode('utf-8') for s in strings]      # dicts keep id order
+    offsets = array('I', accumulate((len(b) for b in encoded), initial=0))
+    blob = b"".join(encoded)
+    header = NETWORK_BINARY_HEADER.pack(NETWORK_BINARY_MAGIC, NETWORK_BINARY_VERSION, digest,
+                                        len(encoded), len(blob), len(network.lines),
+                                        len(info_rows) // 2, len(station_strs) // STATION_STRS)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        for part in (header, offsets, blob, line_rows, info_rows, station_strs, station_nums, totals):
+            f.write(part)
+            f.write(b"\0" * (-f.tell() % 8))
+    os.replace(tmp, path)
+
+def load_network_binary(path, digest, source_path):
+    """Network from a compiled file; None if missing, stale, truncated or another version."""
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        head = f.read(NETWORK_BINARY_HEADER.size)
+        if len(head) < NETWORK_BINARY_HEADER.size:
+            return None
+        magic, version, file_digest, n_str, blob_len, n_lines, n_info, n_st = NETWORK_BINARY_HEADER.unpack(head)
+        if magic != NETWORK_BINARY_MAGIC or version != NETWORK_BINARY_VERSION or file_digest != digest:
+            return None
+        sizes = [(n_str + 1) * 4, blob_len, n_lines * LINE_ROW * 4, n_info * 8,
+                 n_st * STATION_STRS * 4, n_st * STATION_NUMS * 8, n_lines * 8]
+        pos = NETWORK_BINARY_HEADER.size
+        spans = []
+        for size in sizes:
+            pos += -pos % 8
+            spans.append((pos, pos + size))
+            pos += size
+        if os.fstat(f.fileno()).st_size < pos:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            cols = [mm[a:b] for a, b in spans]
+    offsets, blob, line_rows, info_rows, station_strs, station_nums, totals = cols
+    columns = []
+    for data, code in zip((offsets, line_rows, info_rows, station_strs, station_nums, totals), 'IIIIdd'):
+        col = array(code)
+        col.frombytes(data)
+        columns.append(col)
+    offsets, line_rows, info_rows, station_strs, station_nums, totals = columns
+    strings = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(n_str)]
+    string_at = strings.__getitem__
+
+    lines = {}
+    digests = {}
+    for r in range(n_lines):
+        key_id, info_at, n_pairs, first, count, digest_id = line_rows[r * LINE_ROW:(r + 1) * LINE_ROW]
+        key = strings[key_id]
+        info = {strings[info_rows[2 * k]]: strings[info_rows[2 * k + 1]] for k in range(info_at, info_at + n_pairs)}
+        ids = station_strs[first * STATION_STRS:(first + count) * STATION_STRS]
+        nums = station_nums[first * STATION_NUMS:(first + count) * STATION_NUMS]
+        stations = tuple(map(Station, map(string_at, ids[0::STATION_STRS]), nums[0::STATION_NUMS],
+                             map(string_at, ids[1::STATION_STRS]), map(string_at, ids[2::STATION_STRS]),
+                             map(string_at, ids[3::STATION_STRS]), nums[1::STATION_NUMS]))
+        lines[key] = assemble_metro_line(key, info, stations, nums[2::STATION_NUMS],
+                                         nums[3::STATION_NUMS], totals[r])
+        digests[key] = strings[digest_id]
+    return assemble_network(source_path, lines, digests)
+
+def read_network(path):
+    """Network for a data file, from its compiled file when that is up to date."""
+    bin_path = network_binary_path(path)
+    if os.path.exists(bin_path):
+        network = load_network_binary(bin_path, data_file_digest(path), path)
+        if network is not None:
+            return network
+    return load_network(path)
+
+def compile_network(path=None, out_path=None):
+    """Write the compiled file for a data file (next to it by default); returns its path."""
+    path = path or METRO_FILE
+    out_path = out_path or network_binary_path(path)
+    save_network_binary(load_network(path), out_path, data_file_digest(path))
+    return out_path
+
+def main_compile(path=None):
+    path = path or METRO_FILE
+    out_path = compile_network(path)
+    t0 = time.perf_counter()
+    load_network(path)
+    t1 = time.perf_counter()
+    network = read_network(path)
+    t2 = time.perf_counter()
+    print(f"Compiled {path} -> {out_path} ({os.path.getsize(out_path)} bytes)")
+    print(f"Load: text {1000 * (t1 - t0):.1f} ms, compiled {1000 * (t2 - t1):.1f} ms")
+    note = warnings_note(network)
+    if note:
+        print(note, file=sys.stderr)
+
+# Networks are loaded once per process and shared by the timing and journey modules.
+# refresh_network() picks up edits to the file: a stat call when nothing changed, else
+# an incremental load_network() whose result replaces the cached network in one dict
+# assignment. Queries already holding the old network finish on it undisturbed.
+_network_cache = {}
+_network_stamps = {}
+_reload_lock = threading.Lock()
+
+def file_stamp(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def get_network(path=None):
+    path = path or METRO_FILE
+    if path not in _network_cache:
+        _network_stamps[path] = file_stamp(path)
+        _network_cache[path] = read_network(path)
+    return _network_cache[path]
+
+def refresh_network(path=None, config=None):
+    """(network, changed line keys) for path, reloading it if the file changed on disk.
+
+    Only edited [LINE] sections are re-parsed; caches built from the new network (station
+    graph, timetable, name indexes) are warmed before it is swapped in, and per-line data
+    of untouched lines (offsets, distances, name indexes) carries over. The route matrix
+    file is keyed on the data file's digest, so ensure_route_matrix() rebuilds it next time.
+    """
+    path = path or METRO_FILE
+    get_network(path)
+    with _reload_lock:
+        stamp = file_stamp(path)
+        if stamp == _network_stamps.get(path):
+            return _network_cache[path], ()
+        old = _network_cache[path]
+        new = load_network(path, previous=old)
+        if file_stamp(path) != stamp:
+            return old, ()              # still being written; try again next time
+        _network_stamps[path] = stamp
+        changed = tuple(k for k in new.lines if new.lines[k] is not old.lines.get(k))
+        changed += tuple(k for k in old.lines if k not in new.lines)
+        if not changed:
+            return old, ()
+        warm_network_caches(new, config)
+        _network_cache[path] = new
+        # name indexes of the replaced containers are not needed any more
+        for names in [old.station_index, old.lines] + [old.lines[k].names for k in changed if k in old.lines]:
+            _name_index_cache.pop(id(names), None)
+        return new, changed
+
+def warm_network_caches(network, config=None):
+    """Build what queries derive from a network (station graph, timetable, name indexes,
+    departures, route matrix) so the first request after startup or a reload does not pay for it."""
+    config = config or current_config()
+    get_station_graph(network, config)
+    get_timetable(network, config)
+    get_name_index(network.station_index)
+    get_name_index(network.lines)
+    get_departure_index(network, config)
+    get_route_matrix(network, config)
+    for line in network.lines.values():
+        get_name_index(line.names)
+        line_departures(line, True, config)
+        line_departures(line, False, config)
+
+def watch_network(path=None, interval=1.0, on_reload=None, config=None):
+    """Poll the data file every interval seconds from a daemon thread and reload it on
+    change; on_reload(network, changed_keys) is called after each swap. Returns a
+    threading.Event; set it to stop watching."""
+    stop = threading.Event()
+    def run():
+        while not stop.wait(interval):
+            try:
+                network, changed = refresh_network(path, config)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Reload of {path or METRO_FILE} failed: {e}", file=sys.stderr)
+                continue
+            if changed and on_reload:
+                on_reload(network, changed)
+    threading.Thread(target=run, name="metro-data-watch", daemon=True).start()
+    return stop
+
+# -------------------- name search index --------------------
+# Prebuilt lookup over station / line names for exact, prefix, substring and
+# typo-tolerant matching. Keys are normalize_string() with whitespace collapsed.
+#   exact       - key -> ids
+#   sorted_keys - sorted (key, id) pairs; a prefix is one bisect plus a short walk
+#   trigrams    - trigram -> ids, intersected to find substring candidates
+#   trie        - character trie of keys, node = [children, ids_ending_here, ids_below];
+#                 typo search walks it carrying one Levenshtein row per node, so shared
+#                 prefixes are computed once and branches beyond max_edits are pruned
+#   memo        - recent query -> results, for repeated per-keystroke lookups
+# Results keep the names' original order within a tier, like the old linear scans.
+NameIndex = namedtuple('NameIndex', 'names keys exact sorted_keys trigrams trie memo')
+
+MATCH_KINDS = ('exact', 'prefix', 'substring', 'fuzzy')
+NAME_SEARCH_MEMO_SIZE = 4096
+
+def search_key(s):
+    return ' '.join(normalize_string(s).split())
+
+def _trigrams(key):
+    return {key[i:i+3] for i in range(len(key) - 2)}
+
+def build_name_index(names):
+    names = tuple(names)
+    keys = tuple(search_key(n) for n in names)
+    exact = {}
+    trigrams = {}
+    trie = [{}, [], []]
+    for i, key in enumerate(keys):
+        exact.setdefault(key, []).append(i)
+        for tri in _trigrams(key):
+            trigrams.setdefault(tri, set()).add(i)
+        node = trie
+        for ch in key:
+            node = node[0].setdefault(ch, [{}, [], []])
+            node[2].append(i)
+        node[1].append(i)
+    sorted_keys = sorted((key, i) for i, key in enumerate(keys))
+    return NameIndex(names, keys, exact, sorted_keys, trigrams, trie, {})
+
+def _fuzzy_hits(index, key, max_edits, prefix=False):
+    """[(edits, id), ...] for names within max_edits of key (of a name prefix if prefix=True)."""
+    best = {}
+    n = len(key)
+    cap = max_edits + 1
+    # Only cells within max_edits of the diagonal can stay <= max_edits (Ukkonen's band);
+    # everything else is clamped to cap.
+    stack = [(child, ch, 1, [min(j, cap) for j in range(n + 1)])
+             for ch, child in index.trie[0].items()]
+    while stack:
+        node, ch, depth, prev = stack.pop()
+        row = [cap] * (n + 1)
+        lo = max(1, depth - max_edits)
+        hi = min(n, depth + max_edits)
+        if depth <= max_edits:
+            row[0] = depth
+        low = row[0]
+        for j in range(lo, hi + 1):
+            v = prev[j-1] if key[j-1] == ch else prev[j-1] + 1
+            if prev[j] < v: v = prev[j] + 1
+            if row[j-1] < v: v = row[j-1] + 1
+            if v > cap: v = cap
+            row[j] = v
+            if v < low: low = v
+        d = row[n]
+        if d <= max_edits:
+            for i in (node[2] if prefix else node[1]):
+                if d < best.get(i, cap):
+                    best[i] = d
+        if low <= max_edits:
+            stack.extend((child, c, depth + 1, row) for c, child in node[0].items())
+    return [(d, i) for i, d in best.items()]
+
+def search_names(index, query, limit=10, max_edits=2, fuzzy_prefix=False):
+    """Ranked [(name, kind, edits), ...] for query; better tiers are searched first.
+
+    With fuzzy_prefix=True typos are measured against name prefixes (autocomplete),
+    otherwise against whole names.
+    """
+    # the memo holds raw queries as well as normalized keys, so repeated input skips
+    # normalization too (search_key is idempotent, so the two can share one dict)
+    raw_key = (query, limit, max_edits, fuzzy_prefix)
+    cached = index.memo.get(raw_key)
+    if cached is not None:
+        return list(cached)
+    q = search_key(query)
+    if not q:
+        return []
+    memo_key = (q, limit, max_edits, fuzzy_prefix)
+    cached = index.memo.get(memo_key)
+    if cached is not None:
+        index.memo[raw_key] = cached
+        return list(cached)
+    seen = set()
+    results = []
+    def add(tier, hits):
+        for edits, i in sorted(hits):
+            if i not in seen:
+                seen.add(i)
+                results.append((index.names[i], MATCH_KINDS[tier], edits))
+
+    add(0, [(0, i) for i in index.exact.get(q, ())])
+    if len(results) < limit:
+        hits = []
+        k = bisect_left(index.sorted_keys, (q,))
+        while k < len(index.sorted_keys) and index.sorted_keys[k][0].startswith(q):
+            hits.append((0, index.sorted_keys[k][1]))
+            k += 1
+        add(1, hits)
+    if len(results) < limit:
+        if len(q) >= 3:
+            sets = sorted((index.trigrams.get(t, set()) for t in _trigrams(q)), key=len)
+            cands = set.intersection(*sets) if sets else set()
+        else:
+            cands = range(len(index.keys))
+        add(2, [(0, i) for i in cands if q in index.keys[i]])
+    if len(results) < limit and max_edits:
+        add(3, _fuzzy_hits(index, q, max_edits, fuzzy_prefix))
+    results = results[:limit]
+    if len(index.memo) >= NAME_SEARCH_MEMO_SIZE:
+        index.memo.clear()
+    index.memo[memo_key] = index.memo[raw_key] = tuple(results)
+    return results
+
+# Indexes are built on first use for each names container (lines dict, a line's
+# station names, the network station index) and reused while that object lives.
+_name_index_cache = {}
+
+def get_name_index(names):
+    cached = _name_index_cache.get(id(names))
+    if cached is None or cached[0] is not names:
+        cached = _name_index_cache[id(names)] = (names, build_name_index(names))
+    return cached[1]
+
+def suggest_stations(network, text, limit=10):
+    """Autocomplete: ranked station names for partial or misspelt input."""
+    index = get_name_index(network.station_index)
+    # typo budget grows with what has been typed: none for 1-2 chars, 1 up to 5, then 2
+    n = len(search_key(text))
+    max_edits = 0 if n < 3 else (1 if n < 6 else 2)
+    return [name for name, _, _ in search_names(index, text, limit, max_edits, fuzzy_prefix=True)]
 
 # -------------------- schedule helpers --------------------
-def build_departures():
+def build_departures(config=None):
+    config = config or current_config()
     deps = []
-    cur = hhmm_to_min(START_SERVICE)
-    end = hhmm_to_min(END_SERVICE)
+    cur = hhmm_to_min(config.start)
+    end = hhmm_to_min(config.end)
     while cur <= end:
         deps.append(cur)
-        cur += PEAK_FREQ if in_peak(cur) else OFFPEAK_FREQ
+        cur += config.peak_freq if in_peak(cur, config) else config.offpeak_freq
     return deps
 
-def next_train_at_station_for_direction(line_stations, station_name, current_min, towards_end=True):
-    departures = build_departures()
-    offsets = {}
-    cum = 0.0
-    for s in line_stations:
-        offsets[s['name']] = cum
-        cum += s['time']
-    total = cum
+# -------------------- per-line service profiles --------------------
+# ServiceConfig holds the network-wide defaults; a line overrides them with Info headers
+# in its section of the data file:
+#   First_Train / Last_Train    HH:MM of the first and last departure from a terminal
+#   Peak_Periods                HH:MM-HH:MM ranges, comma separated ('-' for none)
+#   Peak_Freq / Offpeak_Freq    headways in minutes
+# A _From_Start / _From_End suffix limits a key to trains leaving Start_Point / End_Point
+# and a Weekend_ prefix to config.day == 'weekend'. The most specific key present wins:
+# Weekend_First_Train_From_End, Weekend_First_Train, First_Train_From_End, First_Train.
+# Values that do not parse are ignored. LineService has the field names ServiceConfig
+# uses for the schedule, so build_departures(), in_peak() and compute_next_arrivals()
+# accept either.
+LineService = namedtuple('LineService', 'start end peak_periods peak_freq offpeak_freq')
+
+def _parse_hhmm(text):
+    m = time_str_to_min(text)
+    return (m // 60, m % 60)
+
+def _parse_periods(text):
+    if text.strip() in ('-', ''):
+        return ()
+    periods = []
+    for part in text.split(','):
+        a, b = part.split('-')
+        periods.append((_parse_hhmm(a), _parse_hhmm(b)))
+    return tuple(periods)
+
+def _parse_headway(text):
+    f = float(text)
+    if f <= 0:
+        raise ValueError("headway must be positive")
+    return int(f) if f.is_integer() else f
+
+SERVICE_INFO_FIELDS = (('start', 'First_Train', _parse_hhmm), ('end', 'Last_Train', _parse_hhmm),
+                       ('peak_periods', 'Peak_Periods', _parse_periods),
+                       ('peak_freq', 'Peak_Freq', _parse_headway),
+                       ('offpeak_freq', 'Offpeak_Freq', _parse_headway))
+
+def build_line_service(info, towards_end, config):
+    suffix = '_From_Start' if towards_end else '_From_End'
+    prefixes = ('Weekend_', '') if config.day == 'weekend' else ('',)
+    values = {}
+    for field, name, parse in SERVICE_INFO_FIELDS:
+        values[field] = getattr(config, field)
+        for key in (p + name + s for p in prefixes for s in (suffix, '')):
+            if key in info:
+                try:
+                    values[field] = parse(info[key])
+                    break
+                except (ValueError, TypeError):
+                    pass
+    return LineService(**values)
+
+# (line_key, towards_end, config) -> (line.info, LineService); the info check drops
+# entries of a line whose section was edited and reloaded.
+_line_service_cache = {}
+
+def line_service(line, towards_end=True, config=None):
+    """Service hours and headways of one direction of a MetroLine."""
+    config = config or current_config()
+    key = (line.key, towards_end, config)
+    cached = _line_service_cache.get(key)
+    if cached is None or cached[0] is not line.info:
+        cached = _line_service_cache[key] = (line.info, build_line_service(line.info, towards_end, config))
+    return cached[1]
+
+def service_window(lines, config=None):
+    """(first, last) departure minute over both directions of the given MetroLines."""
+    services = [line_service(line, d, config) for line in lines for d in (True, False)]
+    if not services:
+        config = config or current_config()
+        return hhmm_to_min(config.start), hhmm_to_min(config.end)
+    return (min(hhmm_to_min(s.start) for s in services), max(hhmm_to_min(s.end) for s in services))
+
+_service_window_cache = {}
+
+def get_service_window(network, config=None):
+    """service_window over every line of the network, built once per network and config."""
+    return cached_for_network(_service_window_cache, network, config or current_config(),
+                              lambda net, cfg: service_window(net.lines.values(), cfg))
+
+# Departure timetables are generated once per service profile and kept sorted, so
+# arrival queries are a binary search instead of a scan of the whole day; directions
+# and lines with the same profile share one tuple.
+_departure_cache = {}
+
+def line_departures(line, towards_end=True, config=None):
+    service = line_service(line, towards_end, config)
+    deps = _departure_cache.get(service)
+    if deps is None:
+        deps = _departure_cache[service] = tuple(build_departures(service))
+    return deps
+
+def next_train_at_station_for_direction(line, station_name, current_min, towards_end=True, config=None):
+    departures = line_departures(line, towards_end, config)
+    i = line.index.get(station_name)
     if towards_end:
-        off = offsets.get(station_name, 0.0)
-        for d in departures:
-            arr = d + off
-            if arr >= current_min: return arr
+        off = line.offsets_from_start[i] if i is not None else 0.0
     else:
-        off_from_end = total - offsets.get(station_name, 0.0)
-        for d in departures:
-            arr = d + off_from_end
-            if arr >= current_min: return arr
+        off = line.offsets_from_end[i] if i is not None else line.total_length
+    k = bisect_left(departures, current_min - off)
+    if k < len(departures):
+        return departures[k] + off
     return None
 
+# Next arrivals at one station in both directions as plain data (minutes of day);
+# format_station_arrivals renders it for the timing module, the HTTP service as JSON.
+StationArrivals = namedtuple('StationArrivals', 'line station time towards_end towards_start')
+DirectionArrivals = namedtuple('DirectionArrivals', 'terminal arrivals')
+
+def station_arrivals(line, station, current_min, max_results=6, config=None):
+    i = line.index[station]
+    def direction(towards_end, offset, terminal):
+        # arrival at the station = departure from the endpoint + offset from that endpoint
+        deps = line_departures(line, towards_end, config)
+        return DirectionArrivals(terminal, tuple(compute_next_arrivals(deps, offset, current_min, max_results,
+                                                                       line_service(line, towards_end, config))))
+    return StationArrivals(line.key, station, current_min,
+                           direction(True, line.offsets_from_start[i], line.line_end),
+                           direction(False, line.offsets_from_end[i], line.line_start))
+
+# -------------------- batch arrival boards --------------------
+# Next arrivals for every station of every line, both directions, in one call.
+# rows[i] is (line_key, station_name) and arrivals is a flat array('d') laid out as
+# [row][direction][k], i.e. arrivals[(i*2 + d)*max_results + k] with d = 0 towards
+# line_end and d = 1 towards line_start; unused slots are NaN.
+ArrivalBoard = namedtuple('ArrivalBoard', 'time rows max_results arrivals')
+
+def batch_next_arrivals(network, times, max_results=6, config=None):
+    """Return one ArrivalBoard per minute-of-day in times (or a single board for a scalar)."""
+    config = config or current_config()
+    single = isinstance(times, (int, float))
+    if single:
+        times = [times]
+    rows = []
+    columns = []   # (departures, offset, service start, service end) per row and direction
+    for ln, line in network.lines.items():
+        directions = []
+        for towards_end in (True, False):
+            service = line_service(line, towards_end, config)
+            directions.append((line_departures(line, towards_end, config),
+                               hhmm_to_min(service.start), hhmm_to_min(service.end)))
+        (deps_fwd, start_fwd, end_fwd), (deps_rev, start_rev, end_rev) = directions
+        for i, name in enumerate(line.names):
+            rows.append((ln, name))
+            columns.append((deps_fwd, line.offsets_from_start[i], start_fwd, end_fwd))
+            columns.append((deps_rev, line.offsets_from_end[i], start_rev, end_rev))
+    nan_row = array('d', [float('nan')]) * max_results
+    boards = []
+    for t in times:
+        out = array('d')
+        for deps, off, start_day, end_day in columns:
+            lo = bisect_left(deps, max(t, start_day) - off)
+            hi = min(bisect_right(deps, end_day - off), lo + max_results)
+            out.extend(d + off for d in deps[lo:hi])
+            out.extend(nan_row[:max_results - max(hi - lo, 0)])
+        boards.append(ArrivalBoard(t, rows, max_results, out))
+    return boards[0] if single else boards
+
 # -------------------- formatting & meta --------------------
 def pretty_line(line_header):
     base = line_header.split('-')[0].strip()
@@ -479,261 +1026,2465 @@ def normalize_parking(val):
     if low in ('available','yes','y','true'): return "Yes"
     return "No"
 
-def get_station_meta(lines_data, station):
+NO_STATION_META = StationMeta("-", "No", "", 0.0)
+
+def get_station_meta(network, station):
     """Return (layout, parking, sample_line_header, distance_at_station) for the station (first found)."""
-    for ln, data in lines_data.items():
-        for s in data['stations']:
-            if s['name'] == station:
-                return (s.get('layout','-'), normalize_parking(s.get('parking','-')), ln, s.get('distance', 0.0))
-    return ("-","No","", 0.0)
-
-# -------------------- single-line trip calculator --------------------
-def calculate_single_line_trip(lines_data, line_name, start_station, end_station):
-    stations = lines_data[line_name]['stations']
-    idx_a = -1; idx_b = -1
-    for i,s in enumerate(stations):
-        if s['name'] == start_station: idx_a = i
-        if s['name'] == end_station: idx_b = i
-    if idx_a == -1 or idx_b == -1:
-        return None, 99999.0
-    path = []; time = 0.0
-    if idx_a < idx_b:
-        subset = stations[idx_a: idx_b + 1]
-        for i in range(len(subset)-1):
-            path.append(subset[i]['name'])
-            time += float(subset[i]['time']) + DWELL_TIME
-        path.append(subset[-1]['name'])
-    else:
-        subset = stations[idx_b: idx_a + 1]
-        subset = list(reversed(subset))
-        for i in range(len(subset)-1):
-            path.append(subset[i]['name'])
-            time += float(subset[i]['time']) + DWELL_TIME
-        path.append(subset[-1]['name'])
-    return path, time
+    return network.station_meta.get(station, NO_STATION_META)
 
 # -------------------- distance helpers --------------------
-def compute_distance_on_line(lines_data, line_name, start_station, end_station):
-    """Sum distances (km) along line segments between start and end (order-aware)."""
-    stations = lines_data[line_name]['stations']
-    # build list of station names and distances (distance is distance to NEXT from that station)
-    names = [s['name'] for s in stations]
-    # find indices
-    try:
-        i_start = names.index(start_station)
-        i_end = names.index(end_station)
-    except ValueError:
+def compute_distance_on_line(network, line_name, start_station, end_station):
+    """Distance (km) along the line between start and end, from the cumulative distance column."""
+    line = network.lines[line_name]
+    i_start = line.index.get(start_station)
+    i_end = line.index.get(end_station)
+    if i_start is None or i_end is None:
         return 0.0
+    # data is given to 0.1 km; rounding drops float drift from the prefix sums
+    return round(abs(line.cum_distance[i_end] - line.cum_distance[i_start]), 3)
+
+def route_distance(network, legs):
+    """Total km along the lines ridden for [(line_key, board, alight), ...]."""
     total = 0.0
-    if i_start <= i_end:
-        # sum distance field for stations i_start .. i_end-1 (distance values are per station to next)
-        for i in range(i_start, i_end):
-            total += float(stations[i].get('distance', 0.0))
-    else:
-        # reverse direction: sum distances from i_end .. i_start-1
-        for i in range(i_end, i_start):
-            total += float(stations[i].get('distance', 0.0))
+    for ln, board, alight in legs:
+        total += compute_distance_on_line(network, ln, board, alight)
     return total
 
-# -------------------- fare by distance (slab) --------------------
-def fare_by_distance_km(dist_km):
-    # Slab-based fare (example table). Adjust if you have a specific tariff.
-    if dist_km <= 2.0: return 10
-    if dist_km <= 5.0: return 20
-    if dist_km <= 12.0: return 30
-    if dist_km <= 21.0: return 40
-    if dist_km <= 32.0: return 50
-    return 60
-
-# -------------------- planner (compact output) --------------------
-def plan_journey_compact(lines_data, station_index, src_pref, dst_pref, start_time_str):
-    # match prefix to exact station name (case-insensitive)
-    def match_station(pref):
-        pref_l = pref.strip().lower()
-        # prefer exact match
-        for s in station_index.keys():
-            if s.lower() == pref_l:
-                return s
-        for s in station_index.keys():
-            if s.lower().startswith(pref_l):
-                return s
-        return None
-
-    src = match_station(src_pref)
-    dst = match_station(dst_pref)
+# -------------------- fares (slabs and discounts) --------------------
+# The tariff lives in a small data file laid out like the network file:
+#   [SLABS]      rows 'up to km | fare', the last row '- | fare' for anything longer
+#   [DISCOUNTS]  rows 'payment | period | percent', period being any, peak or offpeak
+#                (by the tap-in time, in_peak); matching rules add up
+# Without the file (or a section of it) the defaults below apply. A FareTable keeps the
+# slab limits for a bisect and the final price of every slab for each (payment, peak)
+# pair, so pricing a distance is one lookup whatever the discounts are.
+FARE_FILE = "fare_data.txt"
+FARE_SLABS = ((2.0, 10), (5.0, 20), (12.0, 30), (21.0, 40), (32.0, 50), (None, 60))
+FARE_DISCOUNTS = (('card', 'any', 10), ('card', 'offpeak', 10))
+PAYMENT_TYPES = ('token', 'card')
+FARE_PERIODS = ('any', 'peak', 'offpeak')
+
+FareRule = namedtuple('FareRule', 'payment period percent')
+FareTable = namedtuple('FareTable', 'limits fares rules prices')
+
+def make_fare_table(slabs, rules):
+    """FareTable from [(up_to_km or None, fare), ...] and [(payment, period, percent), ...]."""
+    limits, fares = [], []
+    for up_to, fare in slabs:
+        limit = float('inf') if up_to is None else float(up_to)
+        if limits and limit <= limits[-1]:
+            raise ValueError("Fare slabs must have increasing distances.")
+        limits.append(limit)
+        fares.append(int(fare))
+    if not limits or limits[-1] != float('inf'):
+        raise ValueError("The last fare slab must be open-ended ('-').")
+    rules = tuple(FareRule(p, period, float(pct)) for p, period, pct in rules)
+    for rule in rules:
+        if rule.payment not in PAYMENT_TYPES or rule.period not in FARE_PERIODS:
+            raise ValueError(f"Unknown fare rule {rule.payment} | {rule.period}; payment is one of "
+                             f"{', '.join(PAYMENT_TYPES)}, period one of {', '.join(FARE_PERIODS)}.")
+        if not 0 <= rule.percent <= 100:
+            raise ValueError(f"Discount must be 0-100%, got {rule.percent:g}.")
+    prices = {}
+    for payment, peak in product(PAYMENT_TYPES, (True, False)):
+        pct = sum(r.percent for r in rules if r.payment == payment
+                  and r.period in ('any', 'peak' if peak else 'offpeak'))
+        # whole rupees, halves rounded up
+        prices[(payment, peak)] = tuple(int(f * max(0.0, 100 - pct) / 100 + 0.5) for f in fares)
+    return FareTable(tuple(limits), tuple(fares), rules, MappingProxyType(prices))
+
+def parse_fare_sections(sections):
+    """FareTable from split_sections() of a fare file; missing sections keep the defaults."""
+    def rows(name, width):
+        for line in sections.get(name, ()):
+            if line.lower().startswith('format:'): continue
+            parts = [p.strip() for p in line.split('|')]
+            if len(parts) != width:
+                raise ValueError(f"[{name}] row '{line}' needs {width} '|'-separated fields.")
+            yield parts
+    try:
+        slabs = [(None if d in ('-', '') else float(d), int(f)) for d, f in rows('SLABS', 2)]
+        rules = [(p.lower(), period.lower(), float(pct.rstrip('%'))) for p, period, pct in rows('DISCOUNTS', 3)]
+    except ValueError as e:
+        raise ValueError(f"Bad fare file: {e}") from None
+    return make_fare_table(slabs if 'SLABS' in sections else FARE_SLABS,
+                           rules if 'DISCOUNTS' in sections else FARE_DISCOUNTS)
+
+def load_fare_table(path=None):
+    path = path or FARE_FILE
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return make_fare_table(FARE_SLABS, FARE_DISCOUNTS)
+    with f:
+        return parse_fare_sections(split_sections(f))
+
+# Loaded once per process, like the network.
+_fare_table_cache = {}
+
+def get_fare_table(path=None):
+    path = path or FARE_FILE
+    table = _fare_table_cache.get(path)
+    if table is None:
+        table = _fare_table_cache[path] = load_fare_table(path)
+    return table
+
+def fare_slab(dist_km, table):
+    # data is given to 0.1 km; rounding drops float drift so slab edges stay inclusive
+    return bisect_left(table.limits, round(dist_km, 3))
+
+def fare_by_distance_km(dist_km, table=None):
+    """Undiscounted slab fare for a distance."""
+    table = table or get_fare_table()
+    return table.fares[fare_slab(dist_km, table)]
+
+# -------------------- station-pair fares --------------------
+# A tap-out is priced on the distance of the fastest route between the two stations,
+# read from the route matrix, whichever route the rider actually takes. trip_fare (/fare)
+# and the planner (pair_fare, for every JourneyPlan) both price from it. The matrix is
+# loaded (or built) once per network, so a fare is two dict lookups, an array read and
+# a bisect over the few slab limits.
+TripFare = namedtuple('TripFare', 'status src dst distance base fare payment peak')
+
+def trip_fare(network, src_pref, dst_pref, tap_in=None, payment='token', config=None, table=None):
+    """TripFare for a trip between stations (exact names or prefixes) entered at tap_in
+    ('HH:MM' or minutes; None counts as peak); status is 'ok', 'no_station' or 'no_route'."""
+    if payment not in PAYMENT_TYPES:
+        raise ValueError(f"payment must be one of {', '.join(PAYMENT_TYPES)}")
+    config = config or current_config()
+    table = table or get_fare_table()
+    matrix = get_route_matrix(network, config)
+    index = matrix.index
+    src = src_pref if src_pref in index else match_station(network, src_pref)
+    dst = dst_pref if dst_pref in index else match_station(network, dst_pref)
     if not src or not dst:
-        print("❌ Station not found.")
-        return
-
-    src_lines = station_index[src]
-    dst_lines = station_index[dst]
-
-    best_path = []
-    min_time = 99999.0
-    best_plan = None
-
-    # Direct route journey planner
-    common = set(src_lines).intersection(dst_lines)
-    for ln in common:
-        path, dur = calculate_single_line_trip(lines_data, ln, src, dst)
-        if dur < min_time:
-            min_time = dur; best_path = path; best_plan = ('direct', ln)
-
-    # Single transfer
-    for la in src_lines:
-        for lb in dst_lines:
-            if la == lb: continue
-            sta_a = [s['name'] for s in lines_data[la]['stations']]
-            sta_b = [s['name'] for s in lines_data[lb]['stations']]
-            possible_interchanges = set(sta_a).intersection(sta_b)
-            # consider interchange tokens on line la
-            for s in lines_data[la]['stations']:
-                tok = s.get('interchange','').strip()
-                if tok and tok != '-':
-                    for item in [t.strip() for t in tok.split(',') if t.strip()]:
-                        if item in sta_b: possible_interchanges.add(item)
-                        for linekey in lines_data.keys():
-                            if item.lower() in linekey.lower():
-                                for s2 in lines_data[linekey]['stations']:
-                                    if s2['name'] in sta_b and s2['name'] in sta_a:
-                                        possible_interchanges.add(s2['name'])
-            for transfer_point in possible_interchanges:
-                path1, t1 = calculate_single_line_trip(lines_data, la, src, transfer_point)
-                path2, t2 = calculate_single_line_trip(lines_data, lb, transfer_point, dst)
-                total = t1 + INTERCHANGE_TIME + t2
-                if total < min_time:
-                    min_time = total
-                    best_path = path1 + path2[1:]
-                    best_plan = ('transfer', la, lb, transfer_point)
-
-    if min_time == 99999.0:
-        print("❌ No route found (Direct or Single Transfer).")
-        return
-    
-    
-    # schedule-aware times
-    start_min = time_str_to_min(start_time_str)
-    service_start_min = hhmm_to_min(START_SERVICE)
-    service_end_min   = hhmm_to_min(END_SERVICE)
-
-    # If request is outside service hours — inform user and STOP (no journey printed)
-    if start_min < service_start_min or start_min > service_end_min:
-        print(f"⚠ Requested time {min_to_hhmm(start_min)} is outside service hours.")
-        print(f"   Metro service runs from {min_to_ampm(service_start_min)} TO {min_to_ampm(service_end_min)}.")
-        return
+        return TripFare('no_station', src, dst, None, None, None, payment, None)
+    found = route_matrix_lookup(matrix, src, dst)
+    if found is None:
+        return TripFare('no_route', src, dst, None, None, None, payment, None)
+    km = found[1]
+    if isinstance(tap_in, str):
+        tap_in = time_str_to_min(tap_in)
+    peak = tap_in is None or in_peak(tap_in, config)
+    slab = fare_slab(km, table)
+    return TripFare('ok', src, dst, km, table.fares[slab], table.prices[(payment, peak)][slab], payment, peak)
+
+def pair_fare(network, src, dst, config=None):
+    """Undiscounted fare between two exact station names (trip_fare's base fare);
+    None if dst cannot be reached from src."""
+    found = route_matrix_lookup(get_route_matrix(network, config), src, dst)
+    return fare_by_distance_km(found[1]) if found is not None else None
+
+# -------------------- station graph (multi-transfer routing) --------------------
+# Nodes are (line_key, station_name) pairs. Ride edges join neighbouring stations on a
+# line in both directions (time to next + dwell), transfer edges join the same
+# station on two different lines (its transfer_minutes). Each edge is stored as
+# (neighbour_node, minutes, km, is_transfer).
+def build_station_graph(network, config=None):
+    config = config or current_config()
+    graph = {}
+    for ln, line in network.lines.items():
+        stations = line.stations
+        for s in stations:
+            node = (ln, s.name)
+            if node not in graph:
+                graph[node] = []
+        for i in range(len(stations) - 1):
+            a = (ln, stations[i].name)
+            b = (ln, stations[i + 1].name)
+            cost = stations[i].time + config.dwell
+            km = stations[i].distance
+            graph[a].append((b, cost, km, False))
+            graph[b].append((a, cost, km, False))
+    for st, keys in network.interchanges.lines.items():
+        minutes = float(transfer_minutes(network, st, config))
+        for a in keys:
+            for b in keys:
+                if a != b:
+                    graph[(a, st)].append(((b, st), minutes, 0.0, True))
+    return graph
+
+# The graph only depends on the loaded network and timings, so build it once per pair.
+# Two pairs are kept so queries still running on a network replaced by a reload do not
+# evict the (pre-warmed) graph of the new one. The reload watcher and the query threads
+# both fill these caches; builds run unlocked, eviction and insertion under one lock.
+_graph_cache = {}
+_network_caches_lock = threading.Lock()
+
+def cached_for_network(cache, network, config, build):
+    key = (id(network), config)
+    hit = cache.get(key)
+    if hit is None or hit[0] is not network:
+        hit = (network, build(network, config))
+        with _network_caches_lock:
+            if key not in cache:
+                while len(cache) >= 2:
+                    cache.pop(next(iter(cache)))
+            cache[key] = hit
+    return hit[1]
+
+def get_station_graph(network, config=None):
+    return cached_for_network(_graph_cache, network, config or current_config(), build_station_graph)
+
+def shortest_route(graph, station_index, src, dst):
+    """Dijkstra from every line serving src to the first node at dst.
+
+    Costs are compared as (minutes, transfers) so equal-time routes prefer fewer changes.
+    Returns (list_of_nodes, minutes) or (None, 99999.0) when dst is unreachable.
+    """
+    heap = []
+    best = {}
+    prev = {}
+    for ln in station_index.get(src, []):
+        node = (ln, src)
+        best[node] = (0.0, 0)
+        heap.append((0.0, 0, node))
+    heapq.heapify(heap)
+    while heap:
+        cost, transfers, node = heapq.heappop(heap)
+        if best.get(node) != (cost, transfers):
+            continue
+        if node[1] == dst:
+            path = [node]
+            while path[-1] in prev:
+                path.append(prev[path[-1]])
+            path.reverse()
+            return path, cost
+        for nxt, minutes, _, is_transfer in graph[node]:
+            key = (cost + minutes, transfers + (1 if is_transfer else 0))
+            old = best.get(nxt)
+            if old is None or key < old:
+                best[nxt] = key
+                prev[nxt] = node
+                heapq.heappush(heap, (key[0], key[1], nxt))
+    return None, 99999.0
+
+def route_legs(path):
+    """Split a node path into [(line_key, board_station, alight_station), ...]."""
+    legs = []
+    for ln, st in path:
+        if legs and legs[-1][0] == ln:
+            legs[-1][2] = st
+        elif not legs or legs[-1][2] == st:
+            legs.append([ln, st, st])
+    return [tuple(leg) for leg in legs]
+
+# -------------------- alternative routes (k shortest) --------------------
+# Yen's algorithm on the station graph, so alternatives are costed like the best route
+# (ride time + dwell per hop, INTERCHANGE_TIME per change) and ordered by (minutes,
+# transfers). Each next route deviates from an earlier one at some node of it: the
+# earlier routes' next edges there are removed, the stations before it blocked, and the
+# rest searched again. To keep k=5 to a few milliseconds:
+#   - the spur searches are A* on exact minutes-to-destination from one reverse search
+#     (removing edges only makes routes longer, so the bound stays admissible)
+#   - deviations only start at the origin or at interchanges (elsewhere the only way on
+#     is the edge being removed); one whose root plus that bound cannot beat the k-th
+#     candidate is skipped, and a search stops once nothing left can
+#   - search states remember whether they were reached by a transfer; changing twice in
+#     a row (or at the origin) would only repeat a route with extra interchange time
+# Routes no rider would take are dropped: ones that come back to a station they already
+# passed or get back on a line they left.
+ALTERNATIVE_ROUTES = 3
+
+def minutes_to_station(graph, station_index, dst):
+    """{node: fewest minutes from node to dst}; every edge runs both ways, so this is a
+    search from dst's nodes."""
+    dist = {}
+    heap = [(0.0, (ln, dst)) for ln in station_index.get(dst, ())]
+    heapq.heapify(heap)
+    while heap:
+        cost, node = heapq.heappop(heap)
+        if node in dist:
+            continue
+        dist[node] = cost
+        for nxt, minutes, _, _ in graph[node]:
+            if nxt not in dist:
+                heapq.heappush(heap, (cost + minutes, nxt))
+    return dist
+
+def _spur_route(graph, starts, dst, to_dst, blocked_stations, blocked_edges, bound):
+    """A* from starts [(node, minutes, transfers, reached_by_transfer)] to the first node
+    at dst; returns (nodes, minutes, transfers) or None if nothing within bound."""
+    heap = []
+    best = {}
+    prev = {}
+    for node, g, tr, by_transfer in starts:
+        h = to_dst.get(node)
+        if h is not None:
+            state = (node, by_transfer)
+            best[state] = (g, tr)
+            heap.append((g + h, tr, g, state))
+    heapq.heapify(heap)
+    while heap:
+        f, tr, g, state = heapq.heappop(heap)
+        if (f, tr) > bound:
+            return None
+        if best.get(state) != (g, tr):
+            continue
+        node, by_transfer = state
+        if node[1] == dst:
+            path = [state]
+            while path[-1] in prev:
+                path.append(prev[path[-1]])
+            return [s[0] for s in reversed(path)], g, tr
+        for nxt, minutes, _, is_transfer in graph[node]:
+            if (is_transfer and by_transfer) or nxt[1] in blocked_stations or (node, nxt) in blocked_edges:
+                continue
+            h = to_dst.get(nxt)
+            if h is None:
+                continue
+            key = (g + minutes, tr + is_transfer)
+            nxt_state = (nxt, is_transfer)
+            old = best.get(nxt_state)
+            if old is None or key < old:
+                best[nxt_state] = key
+                prev[nxt_state] = state
+                heapq.heappush(heap, (key[0] + h, key[1], key[0], nxt_state))
+    return None
 
+def _path_costs(graph, path):
+    """[(minutes, transfers)] spent reaching each node of a path."""
+    costs = [(0.0, 0)]
+    for a, b in zip(path, path[1:]):
+        minutes, is_transfer = next((m, t) for n, m, _, t in graph[a] if n == b)
+        g, tr = costs[-1]
+        costs.append((g + minutes, tr + is_transfer))
+    return costs
+
+def _doubles_back(path, legs):
+    """True if a route passes a station twice or rides a line again after leaving it."""
+    stations = [st for i, (_, st) in enumerate(path) if i == 0 or path[i - 1][1] != st]
+    return len(stations) != len(set(stations)) or len(legs) != len({leg[0] for leg in legs})
+
+def k_shortest_routes(graph, station_index, src, dst, k=ALTERNATIVE_ROUTES):
+    """Up to k distinct routes from src to dst as [(nodes, minutes, transfers), ...],
+    best first by (minutes, transfers); none from a station to itself."""
+    if src == dst:
+        return []
+    to_dst = minutes_to_station(graph, station_index, dst)
+    inf = (float('inf'), 0)
+    origin = [((ln, src), 0.0, 0, True) for ln in station_index.get(src, ())]
+    first = _spur_route(graph, origin, dst, to_dst, (), (), inf)
+    if first is None:
+        return []
+    found = [first]
+    costs = [_path_costs(graph, first[0])]
+    seen = {tuple(route_legs(first[0]))}
+    candidates = []     # heap of (minutes, transfers, nodes)
+    while len(found) < k:
+        path = found[-1][0]
+        needed = k - len(found)
+        # i = -1 deviates at the origin itself: start on a line no route started on yet
+        for i in range(-1, len(path) - 1):
+            bound = heapq.nsmallest(needed, candidates)[-1][:2] if len(candidates) >= needed else inf
+            if i < 0:
+                used = {p[0] for p, _, _ in found}
+                starts = [s for s in origin if s[0] not in used]
+                blocked_edges = blocked_stations = ()
+            elif i > 0 and len(station_index[path[i][1]]) < 2:
+                continue    # one line: back is blocked, onward is the route itself
+            else:
+                root = path[:i + 1]
+                g, tr = costs[-1][i]
+                if (g + to_dst.get(path[i], inf[0]), tr) > bound:
+                    continue
+                starts = [(path[i], g, tr, i == 0 or path[i - 1][1] == path[i][1])]
+                blocked_edges = {(p[i], p[i + 1]) for p, _, _ in found if len(p) > i + 1 and p[:i + 1] == root}
+                blocked_stations = {st for _, st in root[:-1]} - {path[i][1]}
+            spur = _spur_route(graph, starts, dst, to_dst, blocked_stations, blocked_edges, bound)
+            if spur is None:
+                continue
+            nodes = path[:i] + spur[0] if i >= 0 else spur[0]
+            legs = tuple(route_legs(nodes))
+            if legs in seen or _doubles_back(nodes, legs):
+                continue
+            seen.add(legs)
+            heapq.heappush(candidates, (spur[1], spur[2], nodes))
+        if not candidates:
+            break
+        minutes, transfers, nodes = heapq.heappop(candidates)
+        found.append((nodes, minutes, transfers))
+        costs.append(_path_costs(graph, nodes))
+    return found
+
+def schedule_legs(network, legs, start_min, config=None):
+    """Catch the next train for each leg in turn.
+
+    Returns [(line_key, board, alight, departs, arrives), ...]; the list stops early
+    at the first leg with no more service that day.
+    """
+    config = config or current_config()
+    timed = []
+    ready = start_min
+    for ln, board, alight in legs:
+        line = network.lines[ln]
+        i, j = line.index[board], line.index[alight]
+        dep = next_train_at_station_for_direction(line, board, ready, j >= i, config)
+        if dep is None:
+            break
+        arr = dep + abs(line.offsets_from_start[j] - line.offsets_from_start[i]) + config.dwell
+        timed.append((ln, board, alight, dep, arr))
+        ready = arr + transfer_minutes(network, alight, config)
+    return timed
 
+# -------------------- planner (compact output) --------------------
+# match prefix to exact station name (case-insensitive)
+def match_station(network, pref):
+    # prefer exact match, then the first station starting with the prefix
+    hits = search_names(get_name_index(network.station_index), pref, limit=1, max_edits=0)
+    if hits and hits[0][1] in ('exact', 'prefix'):
+        return hits[0][0]
+    return None
 
-    # print compact journey plan
-    print("\nJourney Plan:")
+# A plan is plain data so thousands can be computed without formatting or stdout I/O;
+# format_journey_plan turns one into the compact CLI text.
+#   status  - 'ok', 'no_station', 'no_route', 'outside_hours' or 'no_service'
+#             (a later leg has no train that day; its departs/arrives are None)
+#   origin  - StationMeta of the start station, each leg carries its alighting station's
+#   fare    - the slab fare between src and dst (pair_fare), whichever legs are ridden;
+#             distance is what those legs cover
+JourneyLeg = namedtuple('JourneyLeg', 'line board alight departs arrives distance meta')
+JourneyPlan = namedtuple('JourneyPlan', 'status src dst start legs distance fare travel_minutes origin')
+
+ROUTERS = ('static', 'timetable')
+
+def plan_journey(network, src_pref, dst_pref, start_time, config=None, routes=None, router='static',
+                 disruption=None):
+    """JourneyPlan for station names/prefixes and a start time ('HH:MM' or minutes).
+
+    router='static' takes the fastest route by ride time and then catches the next train
+    on each leg; router='timetable' picks the legs by earliest arrival on the actual
+    timetable (connection scan), so waits at the start and at transfers count too.
+    routes, if given, is a dict memoizing the static route of each (src, dst) pair; that
+    route does not depend on the start time, so callers planning many trips with one
+    config skip the shortest-path search for every repeated pair.
+    disruption, a DisruptionState, plans on its live timetable (always by timetable).
+    """
+    if router not in ROUTERS:
+        raise ValueError(f"router must be one of {', '.join(ROUTERS)}")
+    config = config or current_config()
+    status, src, dst, legs = resolve_route(network, src_pref, dst_pref, config, routes)
+    if status != 'ok':
+        return JourneyPlan(status, src, dst, None, (), 0.0, None, None, None)
 
-    if best_plan[0] == 'direct':
-        _, line_used = best_plan
-        # start meta
-        layout_src, parking_src, ln_src, _ = get_station_meta(lines_data, src)
-        print(f"Start at {src} ({pretty_line(ln_src)}), layout - {layout_src}, Parking - {parking_src}")
+    # schedule-aware times
+    start_min = time_str_to_min(start_time) if isinstance(start_time, str) else start_time
+    # outside service hours (of every line) nothing is scheduled
+    first, last = get_service_window(network, config)
+    if not first <= start_min <= last:
+        return JourneyPlan('outside_hours', src, dst, start_min, (), 0.0, None, None,
+                           get_station_meta(network, src))
+
+    timed = None
+    if disruption is not None:
+        timed = csa_earliest_arrival(disrupted_timetable(disruption), src, dst, start_min)
+        if timed is not None:
+            legs = [leg[:3] for leg in timed]
+        else:
+            # with nothing getting there, the static route is shown unscheduled
+            timed = []
+    elif router == 'timetable':
+        timed = csa_earliest_arrival(get_timetable(network, config), src, dst, start_min)
+        if timed is not None:
+            legs = [leg[:3] for leg in timed]
+    if timed is None:
+        # static route; with no train left on some leg this yields a partial schedule
+        timed = schedule_legs(network, legs, start_min, config)
+    return build_journey_plan(network, src, dst, start_min, legs, timed, config)
+
+def resolve_route(network, src_pref, dst_pref, config=None, routes=None):
+    """(status, src, dst, static legs) with status 'ok', 'no_station' or 'no_route';
+    routes is the optional per-pair memo described in plan_journey."""
+    src = match_station(network, src_pref)
+    dst = match_station(network, dst_pref)
+    if not src or not dst:
+        return 'no_station', src, dst, None
+    legs = routes.get((src, dst)) if routes is not None else None
+    if legs is None:
+        best_path, _ = shortest_route(get_station_graph(network, config), network.station_index, src, dst)
+        # False marks an unreachable pair in the memo
+        legs = tuple(route_legs(best_path)) if best_path is not None else False
+        if routes is not None:
+            routes[(src, dst)] = legs
+    if legs is False:
+        return 'no_route', src, dst, None
+    return 'ok', src, dst, legs
+
+def build_journey_plan(network, src, dst, start_min, legs, timed, config=None):
+    """'ok' JourneyPlan for legs and their schedule, 'no_service' if timed stops short."""
+    origin = get_station_meta(network, src)
+    plan_legs = []
+    for i, (ln, board, alight) in enumerate(legs):
+        dep, arr = (timed[i][3], timed[i][4]) if i < len(timed) else (None, None)
+        plan_legs.append(JourneyLeg(ln, board, alight, dep, arr,
+                                    compute_distance_on_line(network, ln, board, alight),
+                                    get_station_meta(network, alight)))
+    total_dist = 0.0
+    for leg in plan_legs:
+        total_dist += leg.distance
+    fare = pair_fare(network, src, dst, config)
+    if len(timed) < len(legs):
+        return JourneyPlan('no_service', src, dst, start_min, tuple(plan_legs), total_dist,
+                           fare, None, origin)
+    # actual travel time (schedule-aware)
+    arrival = timed[-1][4] if timed else start_min
+    return JourneyPlan('ok', src, dst, start_min, tuple(plan_legs), total_dist,
+                       fare, int(round(arrival - start_min)), origin)
+
+def format_journey_plan(plan, config=None, network=None):
+    """Compact CLI text for a JourneyPlan; with network, service hours are its lines'."""
+    if plan.status == 'no_station':
+        return "❌ Station not found."
+    if plan.status == 'no_route':
+        return "❌ No route found."
+    if plan.status == 'outside_hours':
+        first, last = get_service_window(network, config) if network else service_window((), config)
+        return (f"⚠ Requested time {min_to_hhmm(plan.start)} is outside service hours.\n"
+                f"   Metro service runs from {min_to_ampm(first)} TO {min_to_ampm(last)}.")
+
+    origin = plan.origin
+    out = ["\nJourney Plan:",
+           f"Start at {plan.src} ({pretty_line(origin.line)}), layout - {origin.layout}, Parking - {origin.parking}"]
+    for i, leg in enumerate(plan.legs):
+        if leg.departs is None:
+            out.append("Next metro at: No service" if i == 0 else "Next connecting metro: No service")
+            return "\n".join(out)
+        if i == 0:
+            out.append(f"Next metro at {min_to_hhmm(leg.departs)}")
+        else:
+            # the transfer station is where the previous leg alighted
+            tf = plan.legs[i - 1].meta
+            out.append(f"Next {pretty_line(leg.line)} metro departs at {min_to_hhmm(leg.departs)}, "
+                       f"layout - {tf.layout}, Parking - {tf.parking}")
+        out.append(f"Arrive at {leg.alight} at {min_to_hhmm(leg.arrives)}, "
+                   f"layout - {leg.meta.layout}, Parking - {leg.meta.parking}")
+        if i + 1 < len(plan.legs):
+            out.append(f"Transfer to {pretty_line(plan.legs[i + 1].line)}")
+    out.append(f"Total distance: {plan.distance:.2f} km")
+    out.append(f"Total travel time: {plan.travel_minutes} minutes")
+    out.append(f"Fare: ₹{plan.fare}")
+    return "\n".join(out)
+
+def plan_journey_compact(network, src_pref, dst_pref, start_time_str, config=None, router='timetable'):
+    plan = cached_plan_journey(network, src_pref, dst_pref, start_time_str, config, router)
+    print(format_journey_plan(plan, config, network))
+    if plan.status == 'ok':
+        others = journey_alternatives(network, plan.src, plan.dst, plan.start, ALTERNATIVE_ROUTES, config)
+        text = format_alternatives(others.plans, plan)
+        if text:
+            print(text)
+    return plan
+
+# Alternatives to offer next to a plan: the k best routes by ride time (RouteOption), or
+# each of them caught at a start time (JourneyPlans, complete ones first by travel time
+# and transfers). All of them cost the same fare, that of the station pair.
+RouteOption = namedtuple('RouteOption', 'legs minutes transfers distance fare')
+JourneyAlternatives = namedtuple('JourneyAlternatives', 'status src dst start plans')
+
+def route_alternatives(network, src_pref, dst_pref, k=ALTERNATIVE_ROUTES, config=None):
+    """(status, src, dst, RouteOptions ranked by ride minutes and transfers)."""
+    config = config or current_config()
+    src = match_station(network, src_pref)
+    dst = match_station(network, dst_pref)
+    if not src or not dst:
+        return 'no_station', src, dst, ()
+    if src == dst:
+        return 'ok', src, dst, ()     # no ride, so nothing to choose between
+    found = k_shortest_routes(get_station_graph(network, config), network.station_index, src, dst, k)
+    if not found:
+        return 'no_route', src, dst, ()
+    options = []
+    fare = pair_fare(network, src, dst, config)
+    for nodes, minutes, transfers in found:
+        legs = tuple(route_legs(nodes))
+        options.append(RouteOption(legs, minutes, transfers, route_distance(network, legs), fare))
+    # minutes are sums of floats; equal routes should tie on them
+    options.sort(key=lambda o: (round(o.minutes, 6), o.transfers))
+    return 'ok', src, dst, tuple(options)
+
+def journey_alternatives(network, src_pref, dst_pref, start_time, k=ALTERNATIVE_ROUTES, config=None):
+    """JourneyAlternatives: the k best routes, each scheduled from start_time."""
+    config = config or current_config()
+    status, src, dst, options = route_alternatives(network, src_pref, dst_pref, k, config)
+    start_min = time_str_to_min(start_time) if isinstance(start_time, str) else start_time
+    if status != 'ok':
+        return JourneyAlternatives(status, src, dst, start_min, ())
+    first, last = get_service_window(network, config)
+    if not first <= start_min <= last:
+        return JourneyAlternatives('outside_hours', src, dst, start_min, ())
+    plans = [build_journey_plan(network, src, dst, start_min, o.legs,
+                                schedule_legs(network, o.legs, start_min, config), config) for o in options]
+    plans.sort(key=lambda p: (p.status != 'ok', p.travel_minutes or 0, len(p.legs)))
+    return JourneyAlternatives('ok', src, dst, start_min, tuple(plans))
+
+def _plan_route(plan):
+    return tuple((leg.line, leg.board, leg.alight) for leg in plan.legs)
+
+def format_alternatives(plans, chosen=None):
+    """One line per complete plan other than chosen, or '' when there is none."""
+    skip = _plan_route(chosen) if chosen else None
+    out = []
+    for plan in plans:
+        if plan.status != 'ok' or _plan_route(plan) == skip:
+            continue
+        # full line names: branches of one line are different routes here
+        via = plan.legs[0].line.title()
+        for prev, leg in zip(plan.legs, plan.legs[1:]):
+            via += f" → {leg.line.title()} at {prev.alight}"
+        changes = len(plan.legs) - 1
+        out.append(f"  {via}: {plan.travel_minutes} minutes, "
+                   f"{changes} transfer{'' if changes == 1 else 's'}, ₹{plan.fare}")
+    return "\n".join(["Other routes:"] + out) if out else ""
+
+# -------------------- plan cache --------------------
+# Most planner traffic repeats a few hundred station pairs. Every start minute between
+# two consecutive trains the journey can begin with gets the same journey, so the cache
+# keys plans on (source, destination, index of the next such train, router, config) and
+# on a hit only re-bases start and travel time on the requested minute. The static
+# router always starts on its route's first leg, so its buckets are that line's headway
+# slots at the origin (its routes are memoized per pair too); the timetable router may
+# take any train leaving the origin, so its buckets are the gaps between those.
+# Entries live in an OrderedDict in least-recently-used order, up to maxsize. A cache
+# serves one network: the first query on a different one (e.g. once refresh_network()
+# has swapped in a reload) empties it. Only the querying thread touches a cache, so the
+# reload watcher never clears entries under a lookup.
+PLAN_CACHE_SIZE = 4096
+
+# entries: OrderedDict key -> JourneyPlan; stats: Counter of hits, misses, evictions and
+# invalidations; owner: {'network': the network the entries were planned on};
+# routes: {config: static route memo as plan_journey takes it}
+PlanCache = namedtuple('PlanCache', 'maxsize entries stats owner routes')
+
+def new_plan_cache(maxsize=PLAN_CACHE_SIZE):
+    return PlanCache(maxsize, OrderedDict(), Counter(), {}, {})
+
+_plan_cache = new_plan_cache()
+
+def build_departure_index(network, config):
+    """{station: sorted departure minutes of every train leaving it}."""
+    tt = get_timetable(network, config)
+    deps = [[] for _ in tt.stations]
+    for d, s in zip(tt.dep, tt.frm):
+        deps[s].append(d)               # connections are sorted by departure
+    return {name: tuple(deps[i]) for i, name in enumerate(tt.stations)}
+
+_departure_index_cache = {}
+
+def get_departure_index(network, config=None):
+    return cached_for_network(_departure_index_cache, network, config or current_config(), build_departure_index)
+
+def clear_plan_cache(cache=None):
+    cache = cache or _plan_cache
+    if cache.entries:
+        cache.stats['invalidations'] += 1
+    cache.entries.clear()
+    cache.owner.clear()
+    cache.routes.clear()
+
+def plan_cache_stats(cache=None):
+    cache = cache or _plan_cache
+    return {'size': len(cache.entries), 'maxsize': cache.maxsize,
+            **{k: cache.stats[k] for k in ('hits', 'misses', 'evictions', 'invalidations')}}
+
+def cached_plan_journey(network, src_pref, dst_pref, start_time, config=None, router='static', cache=None):
+    """plan_journey through a PlanCache (the module's shared one by default)."""
+    cache = cache or _plan_cache
+    config = config or current_config()
+    if cache.owner.get('network') is not network:
+        clear_plan_cache(cache)
+        cache.owner['network'] = network
+    start_min = time_str_to_min(start_time) if isinstance(start_time, str) else start_time
+    routes = cache.routes.setdefault(config, {})
+    status, src, dst, legs = resolve_route(network, src_pref, dst_pref, config, routes)
+    first, last = get_service_window(network, config)
+    if status != 'ok':
+        bucket = None
+    elif not first <= start_min <= last:
+        bucket = -1
+    elif router == 'static' and legs:
+        ln, board, alight = legs[0]
+        line = network.lines[ln]
+        i, j = line.index[board], line.index[alight]
+        off = line.offsets_from_start[i] if j >= i else line.offsets_from_end[i]
+        bucket = bisect_left(line_departures(line, j >= i, config), start_min - off)
+    else:
+        bucket = bisect_left(get_departure_index(network, config)[src], start_min)
+    key = (src, dst, bucket, router, config)
+    plan = cache.entries.get(key)
+    if plan is None:
+        cache.stats['misses'] += 1
+        plan = cache.entries[key] = plan_journey(network, src_pref, dst_pref, start_min, config, routes, router)
+        if len(cache.entries) > cache.maxsize:
+            cache.entries.popitem(last=False)
+            cache.stats['evictions'] += 1
+        return plan
+    cache.stats['hits'] += 1
+    cache.entries.move_to_end(key)
+    if plan.start is None or plan.start == start_min:
+        return plan
+    travel = int(round(plan.legs[-1].arrives - start_min)) if plan.status == 'ok' and plan.legs else plan.travel_minutes
+    return plan._replace(start=start_min, travel_minutes=travel)
+
+# -------------------- timetable routing (connection scan) --------------------
+# The station graph ranks routes by ride time alone; waits only appear once the legs are
+# scheduled. The Connection Scan Algorithm routes on the timetable itself: every train
+# generated from the peak/off-peak schedule is cut into elementary connections (one per
+# hop between adjacent stations), sorted by departure, and a query is one forward scan
+# over that list. Timing matches schedule_legs: a leg arrives dwell minutes after the
+# train reaches the station, and changing trains takes the station's transfer minutes more.
+#   stations      - sorted station names; connections refer to them by position
+#   dep/arr       - train times at the two ends of each connection (sorted by dep)
+#   frm/to/trip   - station positions and trip number of each connection
+#   trips         - (line_key, towards_end, departure from the endpoint) per trip
+#   change        - minutes to change trains at each station
+Timetable = namedtuple('Timetable', 'stations station_ids dep arr frm to trip trips config change')
+
+def build_timetable(network, config=None):
+    config = config or current_config()
+    stations = tuple(sorted(network.station_index))
+    ids = {n: i for i, n in enumerate(stations)}
+    conns = []
+    trips = []
+    for ln, line in network.lines.items():
+        seq = [ids[n] for n in line.names]
+        for towards_end in (True, False):
+            order = list(range(len(seq))) if towards_end else list(range(len(seq) - 1, -1, -1))
+            offs = line.offsets_from_start if towards_end else line.offsets_from_end
+            hops = list(zip(order, order[1:]))
+            for d in line_departures(line, towards_end, config):
+                t = len(trips)
+                trips.append((ln, towards_end, d))
+                for i, j in hops:
+                    conns.append((d + offs[i], d + offs[j], t, seq[i], seq[j]))
+    # by departure, then arrival; a trip's own hops stay in order
+    conns.sort()
+    dep, arr, trip, frm, to = (tuple(col) for col in zip(*conns)) if conns else ((),) * 5
+    change = tuple(transfer_minutes(network, st, config) for st in stations)
+    return Timetable(stations, MappingProxyType(ids), dep, arr, frm, to, trip, tuple(trips), config, change)
+
+_timetable_cache = {}
+
+def get_timetable(network, config=None):
+    return cached_for_network(_timetable_cache, network, config or current_config(), build_timetable)
+
+def csa_earliest_arrival(timetable, src, dst, start_min):
+    """Legs [(line_key, board, alight, departs, arrives), ...] of the journey from src at
+    start_min that reaches dst earliest (same form as schedule_legs); None if dst cannot
+    be reached that day. Ties in arrival time go to the journey with fewer legs."""
+    tt = timetable
+    ids = tt.station_ids
+    if src not in ids or dst not in ids:
+        return None
+    s, g = ids[src], ids[dst]
+    if s == g:
+        return []
+    dwell, change = tt.config.dwell, tt.change
+    dep, arr, frm, to, trip = tt.dep, tt.arr, tt.frm, tt.to, tt.trip
+    inf = float('inf')
+    ready = [inf] * len(tt.stations)     # earliest time a train can be boarded here
+    ready[s] = start_min
+    legs_to = [0] * len(tt.stations)     # legs ridden to get there
+    via = {}                             # station -> (boarding conn, alighting conn)
+    entered = {}                         # trip -> connection where it was boarded
+    best, best_legs = inf, 0
+    for c in range(bisect_left(dep, start_min), len(dep)):
+        d = dep[c]
+        if d >= best:
+            break
+        t, a = trip[c], frm[c]
+        e = entered.get(t)
+        if ready[a] <= d and (e is None or legs_to[a] < legs_to[frm[e]]):
+            # board here, or board the same train here instead of after extra legs
+            e = entered[t] = c
+        elif e is None:
+            continue
+        b = to[c]
+        reached = arr[c] + dwell
+        n = legs_to[frm[e]] + 1
+        if b == g:
+            if reached < best or (reached == best and n < best_legs):
+                best, best_legs = reached, n
+                via[g] = (e, c)
+        elif b != s and (reached + change[b] < ready[b] or (reached + change[b] == ready[b] and n < legs_to[b])):
+            ready[b] = reached + change[b]
+            legs_to[b] = n
+            via[b] = (e, c)
+    if best == inf:
+        return None
+    legs = []
+    node = g
+    while node != s:
+        e, x = via[node]
+        legs.append((tt.trips[trip[e]][0], tt.stations[frm[e]], tt.stations[to[x]], dep[e], arr[x] + dwell))
+        node = frm[e]
+    legs.reverse()
+    return legs
+
+def csa_profile(timetable, src, dst, window_start, window_end, with_legs=False):
+    """Pareto set [(departs, arrives), ...] (ascending) of journeys from src leaving in
+    [window_start, window_end] to dst: each is the earliest arrival for its departure and
+    no later departure in the window arrives as early. One backward scan over the
+    connections, keeping a Pareto list of (departure, arrival at dst) per station.
+    With with_legs=True the items are (departs, arrives, legs) with legs in the
+    csa_earliest_arrival form, rebuilt from links recorded during the same scan."""
+    tt = timetable
+    ids = tt.station_ids
+    if src not in ids or dst not in ids or src == dst:
+        return []
+    s, g = ids[src], ids[dst]
+    dwell, change = tt.config.dwell, tt.change
+    dep, arr, frm, to, trip = tt.dep, tt.arr, tt.frm, tt.to, tt.trip
+    # nothing departing after the arrival of the last departure in the window can matter
+    last = csa_earliest_arrival(tt, src, dst, window_end)
+    horizon = last[-1][4] if last else dep[-1] if dep else window_end
+    inf = float('inf')
+    neg_dep = [[] for _ in tt.stations]    # per station: -departure, ascending
+    arrive = [[] for _ in tt.stations]     # matching earliest arrival at dst
+    links = [[] for _ in tt.stations]      # matching (exit conn, next station's link)
+    on_trip = {}                           # trip -> (earliest arrival staying aboard, link)
+    unreached = (inf, None)
+    for c in range(bisect_right(dep, horizon) - 1, bisect_left(dep, window_start) - 1, -1):
+        t, b = trip[c], to[c]
+        best, link = on_trip.get(t, unreached)
+        if b == g:
+            if arr[c] + dwell < best:
+                best, link = arr[c] + dwell, (c, None)
+        elif neg_dep[b]:
+            # first profile entry at b that can be caught after changing trains
+            k = bisect_right(neg_dep[b], -(arr[c] + dwell + change[b])) - 1
+            if k >= 0 and arrive[b][k] < best:
+                best, link = arrive[b][k], (c, links[b][k])
+        if link is None:
+            continue
+        on_trip[t] = (best, link)
+        a = frm[c]
+        if a == s and dep[c] > window_end:
+            continue
+        if not arrive[a] or best < arrive[a][-1]:
+            entry = (c,) + link         # (boarding conn, exit conn, next link)
+            if neg_dep[a] and neg_dep[a][-1] == -dep[c]:
+                arrive[a][-1], links[a][-1] = best, entry
+            else:
+                neg_dep[a].append(-dep[c])
+                arrive[a].append(best)
+                links[a].append(entry)
+    profile = []
+    for d, when, entry in zip(reversed(neg_dep[s]), reversed(arrive[s]), reversed(links[s])):
+        if -d > window_end:
+            continue
+        if not with_legs:
+            profile.append((-d, when))
+            continue
+        legs = []
+        while entry:
+            board, alight, entry = entry
+            legs.append((tt.trips[trip[board]][0], tt.stations[frm[board]], tt.stations[to[alight]],
+                         dep[board], arr[alight] + dwell))
+        profile.append((-d, when, legs))
+    return profile
+
+# -------------------- departure options (range queries) --------------------
+# "Leave now / in 10 min / in 20 min": every journey worth taking from src to dst that
+# leaves within a window, i.e. the Pareto set in which no later departure arrives as
+# early. router='static' (the default) keeps the fixed route and slides along the first
+# leg's departures, scheduling the remaining legs for each: far cheaper than one plan
+# per candidate time. router='timetable' reads it off one connection-scan profile; that
+# can find routes the fixed one misses, but the backward scan covers every connection
+# of the window, so it costs about as much as planning each departure on its own.
+#   status  - as for JourneyPlan ('ok', 'no_station', 'no_route', 'outside_hours');
+#             'ok' with no options when nothing leaves in the window
+#   options - JourneyPlans by departure time; start is the departure from src
+DepartureOptions = namedtuple('DepartureOptions', 'status src dst window_start window_end options')
+
+def journey_options(network, src_pref, dst_pref, window_start, window_end, config=None,
+                    routes=None, router='static'):
+    if router not in ROUTERS:
+        raise ValueError(f"router must be one of {', '.join(ROUTERS)}")
+    config = config or current_config()
+    to_min = lambda t: time_str_to_min(t) if isinstance(t, str) else t
+    first, last = to_min(window_start), to_min(window_end)
+    status, src, dst, legs = resolve_route(network, src_pref, dst_pref, config, routes)
+    if status != 'ok':
+        return DepartureOptions(status, src, dst, first, last, ())
+    # only departures inside service hours
+    open_min, close_min = get_service_window(network, config)
+    first, last = max(first, open_min), min(last, close_min)
+    if first > last:
+        return DepartureOptions('outside_hours', src, dst, first, last, ())
+
+    options = []
+    if router == 'timetable':
+        for departs, _, timed in csa_profile(get_timetable(network, config), src, dst, first, last, True):
+            options.append(build_journey_plan(network, src, dst, departs, [leg[:3] for leg in timed],
+                                              timed, config))
+    elif legs:
+        ln, board, alight = legs[0]
+        line = network.lines[ln]
+        i, j = line.index[board], line.index[alight]
+        off = line.offsets_from_start[i] if j >= i else line.offsets_from_end[i]
+        deps = line_departures(line, j >= i, config)
+        best = float('inf')
+        # latest departure first: keep one only if it arrives strictly earlier
+        for d in reversed(deps[bisect_left(deps, first - off):bisect_right(deps, last - off)]):
+            timed = schedule_legs(network, legs, d + off, config)
+            if len(timed) == len(legs) and timed[-1][4] < best:
+                best = timed[-1][4]
+                options.append(build_journey_plan(network, src, dst, d + off, legs, timed, config))
+        options.reverse()
+    return DepartureOptions('ok', src, dst, first, last, tuple(options))
+
+# -------------------- precomputed route matrix (optional) --------------------
+# Dense station x station tables (minutes, km, transfers, fare) for O(1) ETA/fare
+# lookups. Built once from the station graph and cached in a binary file keyed by
+# the SHA-256 of what it is built from (see route_matrix_digest), then memory-mapped
+# on startup.
+ROUTE_MATRIX_FILE = "metro_routes.bin"
+ROUTE_MATRIX_MAGIC = b"DMRM"
+ROUTE_MATRIX_VERSION = 2      # 2: km rounded like compute_distance_on_line
+# magic, version, route_matrix_digest, station count, names blob length
+ROUTE_MATRIX_HEADER = struct.Struct("<4sI32sII")
+
+RouteMatrix = namedtuple('RouteMatrix', 'names index minutes km transfers fare')
+
+def data_file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.digest()
+
+def station_route_costs(graph, station_index, src, prev=None):
+    """Single-source Dijkstra; returns {station: (minutes, transfers, km, node)} for every
+    reachable station, node being the (line, station) node it was first reached at.
+    If a prev dict is given it is filled with predecessors, so tree_path() can rebuild routes."""
+    heap = []
+    best = {}
+    km_to = {}
+    for ln in station_index.get(src, []):
+        node = (ln, src)
+        best[node] = (0.0, 0)
+        km_to[node] = 0.0
+        heap.append((0.0, 0, node))
+    heapq.heapify(heap)
+    result = {}
+    while heap:
+        cost, transfers, node = heapq.heappop(heap)
+        if best.get(node) != (cost, transfers):
+            continue
+        if node[1] not in result:
+            result[node[1]] = (cost, transfers, km_to[node], node)
+        for nxt, minutes, km, is_transfer in graph[node]:
+            key = (cost + minutes, transfers + (1 if is_transfer else 0))
+            old = best.get(nxt)
+            if old is None or key < old:
+                best[nxt] = key
+                km_to[nxt] = km_to[node] + km
+                if prev is not None:
+                    prev[nxt] = node
+                heapq.heappush(heap, (key[0], key[1], nxt))
+    return result
+
+def tree_path(prev, node):
+    path = [node]
+    while path[-1] in prev:
+        path.append(prev[path[-1]])
+    path.reverse()
+    return path
+
+def build_route_matrix(network, config=None):
+    station_index = network.station_index
+    # a graph of its own: config may be route_matrix_config's, which the shared graph
+    # cache should not hold
+    graph = build_station_graph(network, config or current_config())
+    names = sorted(station_index)
+    n = len(names)
+    index = {name: i for i, name in enumerate(names)}
+    minutes = array('d', [99999.0]) * (n * n)
+    km = array('d', [0.0]) * (n * n)
+    transfers = array('i', [-1]) * (n * n)
+    fare = array('i', [0]) * (n * n)
+    for i, src in enumerate(names):
+        row = i * n
+        for dst, (t, x, d, _) in station_route_costs(graph, station_index, src).items():
+            j = row + index[dst]
+            minutes[j] = t
+            transfers[j] = x
+            # data is given to 0.1 km; rounding drops float drift from the sums, as in
+            # compute_distance_on_line
+            km[j] = round(d, 3)
+            fare[j] = fare_by_distance_km(d)
+    return RouteMatrix(names, index, minutes, km, transfers, fare)
+
+def save_route_matrix(matrix, path, digest):
+    blob = "\n".join(matrix.names).encode('utf-8')
+    header = ROUTE_MATRIX_HEADER.pack(ROUTE_MATRIX_MAGIC, ROUTE_MATRIX_VERSION, digest,
+                                      len(matrix.names), len(blob))
+    pad = b"\0" * (-(len(header) + len(blob)) % 8)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(blob)
+        f.write(pad)
+        for col in (matrix.minutes, matrix.km, matrix.transfers, matrix.fare):
+            col.tofile(f)
+    os.replace(tmp, path)
+
+def load_route_matrix(path, digest):
+    """Memory-map a cached matrix; returns None if missing, stale or from another version."""
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        head = f.read(ROUTE_MATRIX_HEADER.size)
+        if len(head) < ROUTE_MATRIX_HEADER.size:
+            return None
+        magic, version, file_digest, n, blob_len = ROUTE_MATRIX_HEADER.unpack(head)
+        if magic != ROUTE_MATRIX_MAGIC or version != ROUTE_MATRIX_VERSION or file_digest != digest:
+            return None
+        names = f.read(blob_len).decode('utf-8').split("\n") if n else []
+        pos = ROUTE_MATRIX_HEADER.size + blob_len
+        pos += -pos % 8
+        cells = n * n
+        if os.fstat(f.fileno()).st_size < pos + cells * 24:
+            return None
+        if cells == 0:
+            return RouteMatrix(names, {}, [], [], [], [])
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    minutes = view[pos:pos + cells * 8].cast('d'); pos += cells * 8
+    km = view[pos:pos + cells * 8].cast('d'); pos += cells * 8
+    transfers = view[pos:pos + cells * 4].cast('i'); pos += cells * 4
+    fare = view[pos:pos + cells * 4].cast('i')
+    index = {name: i for i, name in enumerate(names)}
+    return RouteMatrix(names, index, minutes, km, transfers, fare)
+
+def route_matrix_digest(network, config=None):
+    """Cache key: the station rows, interchanges, dwell and change times and slab fares
+    the matrix is built from. Service hours, headways and day type do not change it."""
+    config = config or current_config()
+    h = hashlib.sha256()
+    for key, line in network.lines.items():
+        rows = tuple((s.name, s.time, s.distance) for s in line.stations)
+        h.update(repr((key, rows)).encode('utf-8'))
+    ic = network.interchanges
+    h.update(repr((sorted(ic.lines.items()), sorted(ic.walk.items()))).encode('utf-8'))
+    h.update(repr((config.dwell, config.interchange)).encode('utf-8'))
+    table = get_fare_table()
+    h.update(repr((table.limits, table.fares)).encode('utf-8'))
+    return h.digest()
+
+def ensure_route_matrix(network, cache_path=None, config=None):
+    """Load the cached matrix for the network's data file, rebuilding and saving it when stale."""
+    cache_path = cache_path or ROUTE_MATRIX_FILE
+    digest = route_matrix_digest(network, config)
+    matrix = load_route_matrix(cache_path, digest)
+    if matrix is None:
+        save_route_matrix(build_route_matrix(network, config), cache_path, digest)
+        matrix = load_route_matrix(cache_path, digest)
+    return matrix
+
+# The matrix file serves one network and config at a time; in a process the loaded
+# matrix is kept like the station graph, keyed only on the dwell and change times it
+# depends on, so requests for another day type share it. Without a writable cache file
+# it is built in memory.
+_route_matrix_cache = {}
+
+def route_matrix_config(config):
+    return ServiceConfig(None, None, None, None, None, config.dwell, config.interchange, None)
+
+def _load_or_build_route_matrix(network, config):
+    try:
+        return ensure_route_matrix(network, config=config)
+    except OSError:
+        return build_route_matrix(network, config)
+
+def get_route_matrix(network, config=None):
+    return cached_for_network(_route_matrix_cache, network, route_matrix_config(config or current_config()),
+                              _load_or_build_route_matrix)
+
+def route_matrix_lookup(matrix, src, dst):
+    """Return (minutes, km, transfers, fare) for an exact station pair, or None if unknown/unreachable."""
+    i = matrix.index.get(src)
+    j = matrix.index.get(dst)
+    if i is None or j is None:
+        return None
+    k = i * len(matrix.names) + j
+    if matrix.transfers[k] < 0:
+        return None
+    return (matrix.minutes[k], matrix.km[k], matrix.transfers[k], matrix.fare[k])
+
+def main_precompute():
+    network = get_network()
+    digest = route_matrix_digest(network)
+    save_route_matrix(build_route_matrix(network), ROUTE_MATRIX_FILE, digest)
+    print(f"Route matrix for {len(network.station_index)} stations written to {ROUTE_MATRIX_FILE}")
+
+# -------------------- discrete-event train simulation --------------------
+# Runs every scheduled trip of every line through the day. One heap event per
+# (trip, station) call: the train arrives, dwells (plus any injected hold) and is
+# scheduled into the next station. Run times are "time to next" minus the dwell, so
+# with no delays arrivals match the offsets used by compute_next_arrivals. A train
+# finishing a trip becomes available at the opposite terminal after TURNAROUND_TIME;
+# a departure with no ready train there brings a new train into service.
+TURNAROUND_TIME = 5     # minutes at a terminal before the return trip can start
+
+# timeline[train] is that train's chronological (time, kind, line_key, station) calls,
+# kind 'arr' or 'dep'; trips are (line_key, towards_end, trip_index, train, dep, arr);
+# fleet is the number of trains each line needed.
+SimulationResult = namedtuple('SimulationResult', 'timeline trips fleet')
+
+def simulate_day(network, delays=None, timetables=None, turnaround=TURNAROUND_TIME, config=None):
+    """Simulate a full day of operation.
+
+    delays maps (line_key, towards_end, trip_index, station_name) -> extra minutes held
+    at that station; timetables maps (line_key, towards_end) -> departure minutes and
+    overrides line_departures (e.g. for headway what-ifs).
+    """
+    config = config or current_config()
+    dwell = config.dwell
+    delays = delays or {}
+    timetables = timetables or {}
+    heap = []
+    trips = []
+    for ln, line in network.lines.items():
+        if len(line.stations) < 2:
+            continue
+        for towards_end in (True, False):
+            deps = timetables.get((ln, towards_end))
+            if deps is None:
+                deps = line_departures(line, towards_end, config)
+            for k, d in enumerate(deps):
+                heap.append((d, len(trips), 0))
+                trips.append([ln, towards_end, k, None, d, None])
+    heapq.heapify(heap)
+
+    pools = {}          # (line_key, towards_end) -> deque of (ready_time, train)
+    timeline = {}
+    fleet = {ln: 0 for ln in network.lines}
+    train_line = []
+    while heap:
+        t, trip_id, pos = heapq.heappop(heap)
+        trip = trips[trip_id]
+        ln, towards_end = trip[0], trip[1]
+        line = network.lines[ln]
+        n = len(line.names)
+        idx = pos if towards_end else n - 1 - pos
+        name = line.names[idx]
+        if pos == 0:
+            pool = pools.setdefault((ln, towards_end), deque())
+            if pool and pool[0][0] <= t:
+                train = pool.popleft()[1]
+            else:
+                train = len(train_line)
+                train_line.append(ln)
+                timeline[train] = []
+                fleet[ln] += 1
+            trip[3] = train
+        train = trip[3]
+        calls = timeline[train]
+        calls.append((t, 'arr', ln, name))
+        if pos == n - 1:
+            trip[5] = t
+            pools.setdefault((ln, not towards_end), deque()).append((t + turnaround, train))
+            continue
+        dep = t + dwell + delays.get((ln, towards_end, trip[2], name), 0)
+        calls.append((dep, 'dep', ln, name))
+        run = line.stations[idx].time if towards_end else line.stations[idx - 1].time
+        heapq.heappush(heap, (dep + max(run - dwell, 0.0), trip_id, pos + 1))
+    return SimulationResult(timeline, [tuple(tr) for tr in trips], fleet)
+
+def train_positions_at(result, minute):
+    """{train: (time, kind, line_key, station)} - the last call of every train at or before minute."""
+    positions = {}
+    for train, calls in result.timeline.items():
+        k = bisect_right([c[0] for c in calls], minute)
+        if k:
+            positions[train] = calls[k - 1]
+    return positions
+
+# -------------------- disruptions (live delays and closures) --------------------
+# A DisruptionState overlays live events on the generated timetable. Every trip of a
+# run (one line, one direction) has a delay per hop in travel order: the extra minutes
+# on leaving station p, which it also carries into station p + 1 (run times are not
+# recovered). Events are
+#   hold_train     - a train leaves a station N minutes late
+#   close_segment  - no trains between two stations of a line from start to end; a
+#                    train due to enter meanwhile waits at the last open station until
+#                    end, or with no end the closed hops are not run and trains turn
+#                    short on either side (the far side becomes a trip of its own)
+# Trains on a run cannot overtake: a follower leaves each station at least
+# TRAIN_SEPARATION minutes after its leader, so a held train pushes back the ones
+# behind it until the gap in the timetable absorbs the delay. An event re-times only
+# its own run from the first trip it touches, stopping at the first trip whose delays
+# come out unchanged, and only delayed trips are stored. Knock-on delays through
+# terminal turnarounds are not modelled.
+# Arrival boards read the delays directly. Journey plans scan a copy of the timetable
+# with the delayed trips' connections replaced; it is built lazily after events by
+# splicing them into the sorted columns, not by re-sorting the day.
+TRAIN_SEPARATION = 2    # minutes between trains leaving the same platform
+
+DisruptionRun = namedtuple('DisruptionRun', 'line towards_end first count deps order offsets')
+#   runs     - {(line_key, towards_end): DisruptionRun}; trips first .. first + count - 1
+#              of the timetable, deps their departures, order the travel order of
+#              line positions and offsets the minutes from the terminal at each
+#   holds    - {trip: {hop: minutes}} and closures {(line_key, towards_end): [(first hop,
+#              last hop + 1, start, end or None)]}, the events so far
+#   delays   - {trip: array('d') of delay per hop, inf for a hop that is not run}
+#   cache    - the disrupted Timetable once built ('timetable'); events clear it
+DisruptionState = namedtuple('DisruptionState', 'network timetable runs conns_of holds closures delays cache')
+
+def disruption_state(network, config=None):
+    """Empty DisruptionState on the network's timetable."""
+    tt = get_timetable(network, config)
+    runs = {}
+    for t, (ln, towards_end, _) in enumerate(tt.trips):
+        run = runs.get((ln, towards_end))
+        runs[(ln, towards_end)] = (t, 1) if run is None else (run[0], run[1] + 1)
+    for (ln, towards_end), (first, count) in runs.items():
+        line = network.lines[ln]
+        n = len(line.names)
+        order = tuple(range(n)) if towards_end else tuple(range(n - 1, -1, -1))
+        offs = line.offsets_from_start if towards_end else line.offsets_from_end
+        runs[(ln, towards_end)] = DisruptionRun(line, towards_end, first, count,
+                                                tuple(tt.trips[t][2] for t in range(first, first + count)),
+                                                order, tuple(offs[i] for i in order))
+    conns_of = [[] for _ in tt.trips]
+    for c, t in enumerate(tt.trip):
+        conns_of[t].append(c)
+    return DisruptionState(network, tt, runs, conns_of, {}, {}, {}, {})
+
+def _trip_delays(state, run, k):
+    """Delay per hop of the run's k-th trip from its events and its leader; None if on time."""
+    t = run.first + k
+    d = run.deps[k]
+    leader = state.delays.get(t - 1) if k else None
+    slack = max(d - run.deps[k - 1] - TRAIN_SEPARATION, 0) if k else 0
+    holds = state.holds.get(t, {})
+    closures = state.closures.get((run.line.key, run.towards_end), ())
+    inf = float('inf')
+    out = array('d', [0.0]) * (len(run.order) - 1)
+    carry = 0.0
+    for p in range(len(out)):
+        delay = carry + holds.get(p, 0)
+        if leader is not None and leader[p] != inf:
+            delay = max(delay, leader[p] - slack)
+        sched = d + run.offsets[p]
+        for a, b, start, end in closures:
+            if a <= p < b and start <= sched + delay and (end is None or sched + delay < end):
+                delay = inf if end is None else end - sched
+        out[p] = delay
+        if delay != inf:
+            carry = delay
+    return out if any(out) else None
+
+def _propagate(state, run, k, through=-1):
+    """Re-time the run's trips from the k-th on; past index through, stop at the first
+    one that does not change. Returns the trips that changed."""
+    changed = []
+    for k in range(k, run.count):
+        t = run.first + k
+        new = _trip_delays(state, run, k)
+        if new == state.delays.get(t) and k > through:
+            break
+        if new is None:
+            state.delays.pop(t, None)
+        else:
+            state.delays[t] = new
+        changed.append(t)
+    if changed:
+        state.cache.clear()
+    return changed
+
+def _actual_time(state, run, k, p, arriving=True):
+    """Minute the run's k-th trip reaches (or, arriving=False, leaves) travel position p;
+    None if it does not call there."""
+    delays = state.delays.get(run.first + k)
+    base = run.deps[k] + run.offsets[p]
+    if delays is None:
+        return base
+    last = len(run.order) - 1
+    inf = float('inf')
+    if arriving and p > 0 and delays[p - 1] != inf:
+        return base + delays[p - 1]
+    if p < last and delays[p] != inf:
+        return base + delays[p]
+    return None
 
-        # direction
-        stations = [s['name'] for s in lines_data[line_used]['stations']]
-        if len(best_path) >= 2:
-            towards_end = stations.index(best_path[1]) > stations.index(src)
+def hold_train(state, line_key, towards_end, station, minute, minutes):
+    """Hold the first train leaving station (towards the line's end or start) at or after
+    minute for minutes more; returns the trips re-timed."""
+    run = state.runs[(line_key, towards_end)]
+    p = run.order.index(run.line.index[station])
+    if p == len(run.order) - 1:
+        raise ValueError(f"{station} is the last stop in that direction.")
+    # departures stay in trip order (no overtaking), so the first one at or after minute
+    for k in range(bisect_left(run.deps, minute - run.offsets[p] - _run_max_delay(state, run)), run.count):
+        leaves = _actual_time(state, run, k, p, arriving=False)
+        if leaves is not None and leaves >= minute:
+            holds = state.holds.setdefault(run.first + k, {})
+            holds[p] = holds.get(p, 0) + minutes
+            return _propagate(state, run, k, k)
+    raise LookupError(f"No train leaves {station} after {min_to_hhmm(minute)}.")
+
+def close_segment(state, line_key, station_a, station_b, start, end=None):
+    """Close the line between two of its stations in both directions from start until
+    end (None: rest of the day); returns the trips re-timed."""
+    line = state.network.lines[line_key]
+    i, j = sorted((line.index[station_a], line.index[station_b]))
+    changed = []
+    for towards_end in (True, False):
+        run = state.runs[(line_key, towards_end)]
+        a, b = (i, j) if towards_end else (len(run.order) - 1 - j, len(run.order) - 1 - i)
+        state.closures.setdefault((line_key, towards_end), []).append((a, b, start, end))
+        # every trip that could be inside the closed stretch during the closure
+        k = bisect_left(run.deps, start - run.offsets[b] - _run_max_delay(state, run))
+        last = bisect_right(run.deps, (end if end is not None else float('inf')) - run.offsets[a]) - 1
+        changed += _propagate(state, run, k, last)
+    return changed
+
+def clear_disruptions(state):
+    state.holds.clear()
+    state.closures.clear()
+    state.delays.clear()
+    state.cache.clear()
+
+def _run_max_delay(state, run):
+    inf = float('inf')
+    return max((x for t in range(run.first, run.first + run.count) if t in state.delays
+                for x in state.delays[t] if x != inf), default=0.0)
+
+def disrupted_arrivals(state, line, station, current_min, max_results=6, config=None):
+    """station_arrivals with the live delays and closures of state applied."""
+    i = line.index[station]
+    def direction(towards_end, terminal):
+        run = state.runs[(line.key, towards_end)]
+        service = line_service(line, towards_end, config)
+        p = run.order.index(i)
+        first = max(current_min, hhmm_to_min(service.start))
+        hi = bisect_right(run.deps, hhmm_to_min(service.end) - run.offsets[p])
+        arrivals = []
+        for k in range(bisect_left(run.deps, first - run.offsets[p] - _run_max_delay(state, run)), hi):
+            at = _actual_time(state, run, k, p)
+            if at is not None and at >= first:
+                arrivals.append(at)
+                if len(arrivals) == max_results:
+                    break
+        return DirectionArrivals(terminal, tuple(arrivals))
+    return StationArrivals(line.key, station, current_min,
+                           direction(True, line.line_end), direction(False, line.line_start))
+
+def disrupted_timetable(state):
+    """The state's Timetable with the connections of delayed trips re-timed (closed hops
+    dropped, each part of a short-turned trip under a trip number of its own)."""
+    tt = state.cache.get('timetable')
+    if tt is not None:
+        return tt
+    base = state.timetable
+    ids = base.station_ids
+    inf = float('inf')
+    trips = list(base.trips)
+    removed = []
+    added = []
+    for t, delays in state.delays.items():
+        removed += state.conns_of[t]
+        ln, towards_end, d = base.trips[t]
+        run = state.runs[(ln, towards_end)]
+        names = run.line.names
+        part = t
+        ran = gap = False
+        for p, delay in enumerate(delays):
+            if delay == inf:
+                gap = ran
+                continue
+            if gap:
+                # beyond a closed stretch: riders cannot stay on across it
+                part = len(trips)
+                trips.append(base.trips[t])
+                gap = False
+            ran = True
+            added.append((d + run.offsets[p] + delay, d + run.offsets[p + 1] + delay, part,
+                          ids[names[run.order[p]]], ids[names[run.order[p + 1]]]))
+    added.sort()
+    # splice: drop the old connections, insert the new ones where they sort in
+    cuts = sorted([(c, 1, None) for c in removed] +
+                  [(bisect_right(base.dep, conn[0]), 0, conn) for conn in added])
+    base_cols = (base.dep, base.arr, base.trip, base.frm, base.to)
+    cols = ([], [], [], [], [])
+    pos = 0
+    for c, drop, conn in cuts:
+        if c > pos:
+            for col, src in zip(cols, base_cols):
+                col.extend(src[pos:c])
+            pos = c
+        if drop:
+            pos = c + 1
         else:
+            for col, v in zip(cols, conn):
+                col.append(v)
+    for col, src in zip(cols, base_cols):
+        col.extend(src[pos:])
+    dep, arr, trip, frm, to = cols
+    tt = state.cache['timetable'] = base._replace(dep=dep, arr=arr, frm=frm, to=to, trip=trip,
+                                                  trips=tuple(trips))
+    return tt
+
+def apply_disruption_event(state, event):
+    """Apply one event dict (e.g. parsed from a JSON feed); returns the trips re-timed.
+      {"type": "hold", "line", "station", "towards" (terminal), "time", "minutes"}
+      {"type": "close", "line", "from", "to", "start", optional "end"}
+      {"type": "clear"}"""
+    kind = event.get('type')
+    if kind not in ('hold', 'close', 'clear'):
+        raise ValueError(f"Unknown event type {kind!r}.")
+    if kind == 'clear':
+        changed = list(state.delays)
+        clear_disruptions(state)
+        return changed
+    network = state.network
+    line_key = find_best_line_match(network.lines, str(event.get('line', '')))
+    if not line_key:
+        raise LookupError(f"No matching line for {event.get('line')!r}.")
+    line = network.lines[line_key]
+    def station(field):
+        name = find_station_offsets(line, str(event.get(field, '')))[2]
+        if name is None:
+            raise LookupError(f"Station {event.get(field)!r} not found on {line_key}.")
+        return name
+    if kind == 'hold':
+        towards = search_key(str(event.get('towards', '')))
+        if towards and search_key(line.line_start).startswith(towards):
+            towards_end = False
+        elif towards and search_key(line.line_end).startswith(towards):
             towards_end = True
-
-        next_arr = next_train_at_station_for_direction(lines_data[line_used]['stations'], src, start_min, towards_end)
-        if next_arr is None:
-            print("Next metro at: No service")
-            return
-        print(f"Next metro at {min_to_hhmm(next_arr)}")
-
-        # compute arrival time at destination using offsets (minutes)
-        offsets = lines_data[line_used]['offsets_from_start']
-        travel_offset = abs(offsets.get(best_path[-1], 0.0) - offsets.get(src, 0.0))
-        arrival_time = next_arr + travel_offset + DWELL_TIME
-
-
-        # destination meta
-        layout_dst, parking_dst, ln_dst, _ = get_station_meta(lines_data, best_path[-1])
-        print(f"Arrive at {best_path[-1]} at {min_to_hhmm(arrival_time)}, layout - {layout_dst}, Parking - {parking_dst}")
-
-        # compute distance (sum distances along line)
-        dist_km = compute_distance_on_line(lines_data, line_used, src, best_path[-1])
-        print(f"Total distance: {dist_km:.2f} km")
-
-        # fare by distance slabs
-        fare = fare_by_distance_km(dist_km)
-        # actual travel time (schedule-aware)
-        total_minutes = int(round(arrival_time - start_min))
-        print(f"Total travel time: {total_minutes} minutes")
-        print(f"Fare: ₹{fare}")
+        else:
+            raise ValueError(f"'towards' must be {line.line_start} or {line.line_end}.")
+        return hold_train(state, line_key, towards_end, station('station'),
+                          time_str_to_min(event['time']), float(event['minutes']))
+    end = event.get('end')
+    return close_segment(state, line_key, station('from'), station('to'),
+                         time_str_to_min(event['start']), time_str_to_min(end) if end else None)
+
+def main_disrupt(path=None):
+    """Apply JSON-lines events from path (stdin if None) as they arrive. Besides the event
+    types of apply_disruption_event, {"type": "arrivals", "line", "station", "time"} and
+    {"type": "plan", "from", "to", "time"} print the board or plan as it now stands."""
+    network = get_network()
+    state = disruption_state(network)
+    f = open(path, 'r', encoding='utf-8') if path else sys.stdin
+    try:
+        for raw in f:
+            if not raw.strip():
+                continue
+            try:
+                event = json.loads(raw)
+                kind = event.get('type')
+                if kind == 'arrivals':
+                    line = network.lines.get(find_best_line_match(network.lines, event['line']) or '')
+                    name = find_station_offsets(line, event['station'])[2] if line else None
+                    if name is None:
+                        raise LookupError("Line or station not found.")
+                    print(format_station_arrivals(disrupted_arrivals(state, line, name,
+                                                                     time_str_to_min(event['time']))))
+                elif kind == 'plan':
+                    plan = plan_journey(network, event['from'], event['to'], event['time'],
+                                        router='timetable', disruption=state)
+                    print(format_journey_plan(plan, network=network))
+                else:
+                    t0 = time.perf_counter()
+                    changed = apply_disruption_event(state, event)
+                    print(f"{kind}: {len(changed)} trips re-timed in {1000 * (time.perf_counter() - t0):.2f} ms")
+            except (KeyError, LookupError, ValueError, json.JSONDecodeError) as e:
+                print(f"Skipped event {raw.strip()}: {e}", file=sys.stderr)
+            sys.stdout.flush()
+    finally:
+        if path:
+            f.close()
+
+# -------------------- passenger demand & crowding --------------------
+# Demand is a list of (origin, destination, minute, passengers) groups, so the work
+# scales with the number of groups rather than the number of riders. Each OD pair is
+# routed once; groups are then loaded leg by leg onto the scheduled trips of
+# line_departures in order of when they reach the platform. A trip's load is an
+# array('i') with one cell per segment (in travel order); riders who do not fit wait
+# for the next trip and are counted as denied boardings at that station.
+# While assigning, each trip keeps a difference array (+riders where they board,
+# -riders where they alight) and a running total of boardings, so loading a group is
+# two writes; the real segment loads are only summed when that total could exceed
+# capacity, and once at the end.
+TRAIN_CAPACITY = 2000   # passengers per train
+PEAK_DEMAND_FACTOR = 2  # riders per minute in a peak relative to off-peak
+
+# trip_loads: (line_key, towards_end) -> [segment loads per trip_index]
+CrowdingResult = namedtuple('CrowdingResult', 'trip_loads boardings alightings denied delivered unserved')
+
+def synthetic_demand(network, total_trips, seed=None, bucket=1, config=None):
+    """Random demand aggregated into (origin, destination, minute, passengers) groups.
+
+    Stations served by more lines attract proportionally more trips and peak minutes
+    get twice the off-peak rate; start minutes are rounded to bucket-minute slots.
+    """
+    config = config or current_config()
+    rnd = random.Random(seed)
+    names = sorted(network.station_index)
+    weights = [len(network.station_index[n]) for n in names]
+    minutes = list(range(hhmm_to_min(config.start), hhmm_to_min(config.end), bucket))
+    minute_weights = [PEAK_DEMAND_FACTOR if in_peak(x, config) else 1 for x in minutes]
+    origins = rnd.choices(range(len(names)), weights, k=total_trips)
+    dests = rnd.choices(range(len(names)), weights, k=total_trips)
+    starts = rnd.choices(minutes, minute_weights, k=total_trips)
+    groups = Counter(zip(origins, dests, starts))
+    return [(names[o], names[d], t, c) for (o, d, t), c in groups.items() if o != d]
+
+def assign_demand(network, demand, capacity=TRAIN_CAPACITY, config=None):
+    config = config or current_config()
+    graph = get_station_graph(network, config)
+    trees = {}          # origin -> (route costs, predecessors), one Dijkstra per origin
+    routes = {}         # (origin, destination) -> legs
+    leg_info = {}       # (line, board, alight) -> (departures, diffs, boarded, a, b, offsets)
+    trip_diffs = {}
+    boardings = Counter()
+    alightings = Counter()
+    denied = Counter()
+    delivered = 0
+    unserved = 0
+    # First legs come from the demand sorted by minute; only transfer continuations,
+    # which appear while assigning, need the heap.
+    pending = sorted((minute, o, d, count) for o, d, minute, count in demand)
+    heap = []
+    seq = 0
+    p = 0
+    while p < len(pending) or heap:
+        if heap and (p == len(pending) or heap[0][0] < pending[p][0]):
+            ready, _, o, d, leg_no, count = heapq.heappop(heap)
+        else:
+            ready, o, d, count = pending[p]
+            leg_no = 0
+            p += 1
+        legs = routes.get((o, d))
+        if legs is None:
+            tree = trees.get(o)
+            if tree is None:
+                prev = {}
+                tree = trees[o] = (station_route_costs(graph, network.station_index, o, prev), prev)
+            reached = tree[0].get(d)
+            legs = routes[(o, d)] = route_legs(tree_path(tree[1], reached[3])) if reached else ()
+        if not legs:
+            unserved += count
+            continue
+        board, alight = legs[leg_no][1], legs[leg_no][2]
+        info = leg_info.get(legs[leg_no])
+        if info is None:
+            ln = legs[leg_no][0]
+            line = network.lines[ln]
+            n = len(line.names)
+            i, j = line.index[board], line.index[alight]
+            towards_end = j >= i
+            if towards_end:
+                a, b = i, j
+                off_board, off_alight = line.offsets_from_start[i], line.offsets_from_start[j]
+            else:
+                a, b = n - 1 - i, n - 1 - j
+                off_board, off_alight = line.offsets_from_end[i], line.offsets_from_end[j]
+            deps = line_departures(line, towards_end, config)
+            diffs = trip_diffs.get((ln, towards_end))
+            if diffs is None:
+                diffs = trip_diffs[(ln, towards_end)] = ([array('i', [0]) * n for _ in deps],
+                                                         array('i', [0]) * len(deps))
+            info = leg_info[legs[leg_no]] = (deps, diffs[0], diffs[1], a, b, off_board, off_alight)
+        deps, diffs, boarded, a, b, off_board, off_alight = info
+        last_leg = leg_no + 1 == len(legs)
+        k = bisect_left(deps, ready - off_board)
+        while count and k < len(deps):
+            diff = diffs[k]
+            if boarded[k] + count <= capacity:
+                take = count
+            else:
+                take = min(count, capacity - max(list(accumulate(diff))[a:b], default=0))
+            if take > 0:
+                diff[a] += take
+                diff[b] -= take
+                boarded[k] += take
+                boardings[board] += take
+                alightings[alight] += take
+                if last_leg:
+                    delivered += take
+                else:
+                    seq += 1
+                    heapq.heappush(heap, (deps[k] + off_alight + transfer_minutes(network, alight, config),
+                                          seq, o, d, leg_no + 1, take))
+                count -= take
+            if count:
+                denied[board] += count
+            k += 1
+        unserved += count
+    trip_loads = {key: [array('i', accumulate(diff[:-1])) for diff in diffs]
+                  for key, (diffs, _) in trip_diffs.items()}
+    return CrowdingResult(trip_loads, boardings, alightings, denied, delivered, unserved)
+
+def trip_peak_loads(result):
+    """{(line_key, towards_end, trip_index): highest segment load}."""
+    return {(ln, towards_end, k): max(seg, default=0)
+            for (ln, towards_end), loads in result.trip_loads.items()
+            for k, seg in enumerate(loads)}
+
+def train_peak_loads(result, simulation):
+    """Map trip peaks onto the trains that ran them in a simulate_day() result."""
+    peaks = trip_peak_loads(result)
+    per_train = {}
+    for ln, towards_end, k, train, _, _ in simulation.trips:
+        load = peaks.get((ln, towards_end, k), 0)
+        if load > per_train.get(train, -1):
+            per_train[train] = load
+    return per_train
+
+# -------------------- scenario runner --------------------
+# Sweeps ServiceConfig variants and compares schedule-aware average journey times over
+# one fixed sample of (source, destination, start minute) queries. Scenarios fan out
+# over a process pool; each worker gets the network via get_network() (inherited
+# from the parent's cache when processes are forked) and only reads it.
+ScenarioResult = namedtuple('ScenarioResult', 'name config avg_minutes served queries')
+
+def scenario_queries(network, count=500, seed=0, config=None):
+    config = config or current_config()
+    rnd = random.Random(seed)
+    names = sorted(network.station_index)
+    start, end = hhmm_to_min(config.start), hhmm_to_min(config.end)
+    queries = []
+    while len(queries) < count:
+        src, dst = rnd.sample(names, 2)
+        queries.append((src, dst, rnd.randrange(start, end)))
+    return queries
+
+def evaluate_scenario(network, config, queries):
+    """(average door-to-door minutes, journeys completed) for the queries under config."""
+    graph = get_station_graph(network, config)
+    total = 0.0
+    served = 0
+    routes = {}
+    for src, dst, minute in queries:
+        legs = routes.get((src, dst))
+        if legs is None:
+            path, _ = shortest_route(graph, network.station_index, src, dst)
+            legs = routes[(src, dst)] = route_legs(path) if path else ()
+        if not legs:
+            continue
+        timed = schedule_legs(network, legs, minute, config)
+        if len(timed) == len(legs):
+            total += timed[-1][4] - minute
+            served += 1
+    return (total / served if served else None), served
+
+def scenario_grid(base=None, **choices):
+    """[(name, ServiceConfig), ...] for every combination of the given field values,
+    e.g. scenario_grid(peak_freq=[3, 4, 5], dwell=[0.5, 1.0])."""
+    base = base or current_config()
+    fields = sorted(choices)
+    grid = []
+    for values in product(*(choices[f] for f in fields)):
+        changes = dict(zip(fields, values))
+        name = ", ".join(f"{f}={v}" for f, v in changes.items()) or "baseline"
+        grid.append((name, base._replace(**changes)))
+    return grid
+
+_scenario_worker = {}
+
+def _init_scenario_worker(path, queries):
+    _scenario_worker['network'] = get_network(path)
+    _scenario_worker['queries'] = queries
+
+def _run_scenario(item):
+    name, config = item
+    queries = _scenario_worker['queries']
+    avg, served = evaluate_scenario(_scenario_worker['network'], config, queries)
+    return ScenarioResult(name, config, avg, served, len(queries))
+
+def run_scenarios(scenarios, network=None, queries=None, workers=None):
+    """Evaluate [(name, ServiceConfig), ...] in worker processes; results keep input order."""
+    network = network or get_network()
+    queries = queries or scenario_queries(network)
+    _network_cache.setdefault(network.path, network)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_scenario_worker,
+                             initargs=(network.path, queries)) as pool:
+        return list(pool.map(_run_scenario, scenarios, chunksize=max(1, len(scenarios) // 32)))
+
+def print_scenario_summary(results):
+    ranked = sorted(results, key=lambda r: (r.avg_minutes is None, r.avg_minutes or 0.0))
+    width = max([len(r.name) for r in ranked] + [8])
+    print(f"{'Scenario':<{width}}  {'Avg min':>8}  {'Served':>9}")
+    for r in ranked:
+        avg = f"{r.avg_minutes:.2f}" if r.avg_minutes is not None else "-"
+        print(f"{r.name:<{width}}  {avg:>8}  {f'{r.served}/{r.queries}':>9}")
+
+def main_scenarios():
+    grid = scenario_grid(peak_freq=[3, 4, 5], offpeak_freq=[6, 8, 10], interchange=[2, 4])
+    print_scenario_summary(run_scenarios(grid))
+
+# -------------------- headway optimizer --------------------
+# Picks a peak and an off-peak headway for every line so that the average wait (half
+# the headway, for riders turning up at random) is lowest within a fleet budget. A
+# line's cycle is a round trip at the simulated run times (each hop takes
+# max(time to next, dwell)) plus a turnaround at each end. Both terminals dispatch on
+# the same clock, so a train waits for the next slot after turning round and running
+# every h minutes needs 2 * ceil(cycle / 2 / h) trains; a line's fleet is what its
+# busier period needs.
+# For each line all headway choices are costed per period as columns, and only the
+# cheapest (peak, off-peak) pair for each train count is kept; a knapsack over the
+# fleet budget then combines the lines exactly, covering all
+# len(choices) ** (2 * lines) configurations without listing them.
+# Riders default to a line's station count per off-peak minute, PEAK_DEMAND_FACTOR
+# times that in its peaks (as in synthetic_demand); train_hour_cost, in rider-minutes
+# of waiting per train-hour run, lets fewer off-peak trains win over shorter waits.
+HEADWAY_CHOICES = (2, 2.5, 3, 4, 5, 6, 8, 10, 12, 15)
+
+LineCycle = namedtuple('LineCycle', 'line cycle peak_minutes offpeak_minutes peak_riders offpeak_riders')
+# headways: {line_key: (peak, off-peak)}, peak None for a line without peak periods;
+# trains: {line_key: fleet}; candidates: configurations the search covered
+HeadwayPlan = namedtuple('HeadwayPlan', 'fleet avg_wait train_hours headways trains candidates')
+
+def line_cycles(network, turnaround=TURNAROUND_TIME, config=None, riders=None):
+    """LineCycle for every line with two or more stations; riders, if given, maps
+    (line_key, 'peak' or 'offpeak') -> riders in that period instead of the default."""
+    config = config or current_config()
+    cycles = []
+    for ln, line in network.lines.items():
+        if len(line.stations) < 2:
+            continue
+        one_way = sum(max(s.time, config.dwell) for s in line.stations[:-1])
+        service = line_service(line, True, config)
+        start, end = hhmm_to_min(service.start), hhmm_to_min(service.end)
+        peak = sum(max(0, min(end, hhmm_to_min(b)) - max(start, hhmm_to_min(a)))
+                   for a, b in service.peak_periods)
+        offpeak = max(end - start - peak, 0)
+        if riders is not None:
+            peak_riders, offpeak_riders = riders.get((ln, 'peak'), 0), riders.get((ln, 'offpeak'), 0)
+        else:
+            peak_riders = len(line.stations) * peak * PEAK_DEMAND_FACTOR
+            offpeak_riders = len(line.stations) * offpeak
+        cycles.append(LineCycle(ln, 2 * (one_way + turnaround), peak, offpeak, peak_riders, offpeak_riders))
+    return cycles
+
+def trains_for_headway(cycle, headway):
+    return 2 * int(-(-cycle / 2 // headway))
+
+def _period_columns(cycle, minutes, riders, choices, train_hour_cost):
+    """[(trains, cost, headway)] per choice for one period; one free entry if it is empty."""
+    if minutes <= 0:
+        return [(0, 0.0, None)]
+    trains = [trains_for_headway(cycle, h) for h in choices]
+    return [(n, riders * h / 2 + train_hour_cost * n * minutes / 60, h) for n, h in zip(trains, choices)]
+
+def headway_options(lc, choices=HEADWAY_CHOICES, train_hour_cost=0.0):
+    """{trains: (cost, (peak, off-peak))} - the cheapest headway pair for each fleet size."""
+    peak = _period_columns(lc.cycle, lc.peak_minutes, lc.peak_riders, choices, train_hour_cost)
+    offpeak = _period_columns(lc.cycle, lc.offpeak_minutes, lc.offpeak_riders, choices, train_hour_cost)
+    options = {}
+    for (n_p, cost_p, h_p), (n_o, cost_o, h_o) in product(peak, offpeak):
+        n = max(n_p, n_o)
+        cost = cost_p + cost_o
+        if n not in options or cost < options[n][0]:
+            options[n] = (cost, (h_p, h_o))
+    return options
+
+def evaluate_headways(cycles, headways):
+    """(fleet, average wait, train-hours, {line_key: trains}) for {line_key: (peak, off-peak)}."""
+    fleet = 0
+    wait = riders = hours = 0.0
+    trains = {}
+    for lc in cycles:
+        h_p, h_o = headways[lc.line]
+        n_p = trains_for_headway(lc.cycle, h_p) if lc.peak_minutes > 0 else 0
+        n_o = trains_for_headway(lc.cycle, h_o) if lc.offpeak_minutes > 0 else 0
+        trains[lc.line] = max(n_p, n_o)
+        fleet += trains[lc.line]
+        hours += (n_p * lc.peak_minutes + n_o * lc.offpeak_minutes) / 60
+        if lc.peak_minutes > 0:
+            wait += lc.peak_riders * h_p / 2
+        if lc.offpeak_minutes > 0:
+            wait += lc.offpeak_riders * h_o / 2
+        riders += lc.peak_riders + lc.offpeak_riders
+    return fleet, (wait / riders if riders else 0.0), hours, trains
+
+def optimize_headways(network, fleet_budget, choices=HEADWAY_CHOICES, turnaround=TURNAROUND_TIME,
+                      train_hour_cost=0.0, riders=None, config=None):
+    """Cheapest HeadwayPlan whose fleet fits fleet_budget, or None if even the longest
+    headways need more trains."""
+    cycles = line_cycles(network, turnaround, config, riders)
+    # best[fleet] = (cost, picks per line so far); a larger fleet is only kept if cheaper
+    best = {0: (0.0, ())}
+    for lc in cycles:
+        options = headway_options(lc, choices, train_hour_cost)
+        combined = {}
+        for f, (cost, picks) in best.items():
+            for n, (opt_cost, pick) in options.items():
+                total = cost + opt_cost
+                if f + n <= fleet_budget and (f + n not in combined or total < combined[f + n][0]):
+                    combined[f + n] = (total, picks + (pick,))
+        best = {}
+        lowest = float('inf')
+        for f in sorted(combined):
+            if combined[f][0] < lowest:
+                lowest = combined[f][0]
+                best[f] = combined[f]
+        if not best:
+            return None
+    _, picks = min(best.values())
+    headways = {lc.line: pick for lc, pick in zip(cycles, picks)}
+    fleet, avg_wait, hours, trains = evaluate_headways(cycles, headways)
+    return HeadwayPlan(fleet, avg_wait, hours, headways, trains, len(choices) ** (2 * len(cycles)))
+
+def headway_timetables(network, headways, config=None):
+    """{(line_key, towards_end): departures} for {line_key: (peak, off-peak)} headways,
+    in the form simulate_day() takes as timetables."""
+    timetables = {}
+    for ln, (h_p, h_o) in headways.items():
+        line = network.lines[ln]
+        for towards_end in (True, False):
+            service = line_service(line, towards_end, config)
+            timetables[(ln, towards_end)] = tuple(build_departures(
+                service._replace(peak_freq=h_p or service.peak_freq, offpeak_freq=h_o)))
+    return timetables
+
+def main_headways(fleet_budget=None, train_hour_cost=0.0):
+    network = get_network()
+    config = current_config()
+    cycles = line_cycles(network, config=config)
+    current = {lc.line: (line_service(network.lines[lc.line], True, config).peak_freq,
+                         line_service(network.lines[lc.line], True, config).offpeak_freq) for lc in cycles}
+    base_fleet, base_wait, base_hours, _ = evaluate_headways(cycles, current)
+    fleet_budget = fleet_budget or base_fleet
+    t0 = time.perf_counter()
+    plan = optimize_headways(network, fleet_budget, train_hour_cost=train_hour_cost, config=config)
+    elapsed = time.perf_counter() - t0
+    print(f"Current headways: {base_fleet} trains, average wait {base_wait:.2f} min, "
+          f"{base_hours:.0f} train-hours")
+    if plan is None:
+        print(f"No headways in {HEADWAY_CHOICES} fit a fleet of {fleet_budget} trains.")
         return
-
-    # transfer case
-    _, la, lb, transfer_point = best_plan
-    layout_src, parking_src, ln_src, _ = get_station_meta(lines_data, src)
-    print(f"Start at {src} ({pretty_line(ln_src)}), layout - {layout_src}, Parking - {parking_src}")
-
-    # first leg next train
-    stations_a = [s['name'] for s in lines_data[la]['stations']]
-    idx_src = stations_a.index(src); idx_transfer = stations_a.index(transfer_point)
-    towards_end_a = idx_transfer > idx_src
-    next_arr_src = next_train_at_station_for_direction(lines_data[la]['stations'], src, start_min, towards_end_a)
-    if next_arr_src is None:
-        print("Next metro at: No service")
+    print(f"Best for a fleet of {fleet_budget} ({plan.candidates:.2e} configurations, {1000 * elapsed:.1f} ms):")
+    width = max(len(ln) for ln in plan.headways)
+    print(f"{'Line':<{width}}  {'Cycle':>6}  {'Peak':>5}  {'Off':>5}  {'Trains':>6}")
+    for lc in cycles:
+        h_p, h_o = plan.headways[lc.line]
+        print(f"{lc.line:<{width}}  {lc.cycle:>6.1f}  {h_p if h_p is not None else '-':>5}  {h_o if h_o is not None else '-':>5}  "
+              f"{plan.trains[lc.line]:>6}")
+    simulated = simulate_day(network, timetables=headway_timetables(network, plan.headways, config),
+                             config=config).fleet
+    print(f"Fleet {plan.fleet} (simulated: {sum(simulated.values())}), average wait {plan.avg_wait:.2f} min, "
+          f"{plan.train_hours:.0f} train-hours")
+
+# -------------------- benchmark harness --------------------
+# Fixed, seeded workloads for the hot paths. Each operation is timed on its own so the
+# report has throughput plus p50/p99 latency; a stored baseline (JSON) turns it into a
+# regression check. Baselines are machine specific - save one where you compare.
+BENCH_BASELINE_FILE = "bench_baseline.json"
+BENCH_THRESHOLD = 0.25      # fail when a workload's p50 is >25% slower than baseline
+
+def enlarge_network_file(src_path, dst_path, factor):
+    """Write a copy of the data file with every [LINE] section repeated factor times
+    (line and station names suffixed with the copy number)."""
+    with open(src_path, 'r', encoding='utf-8') as f:
+        text = f.read().splitlines()
+    out = []
+    for k in range(factor):
+        for raw in text:
+            line = raw.strip()
+            if line.startswith('[') and line.endswith(']'):
+                out.append(f"[{line[1:-1].strip()} #{k}]")
+            elif '|' in line and not line.lower().startswith('format:'):
+                name, rest = line.split('|', 1)
+                out.append(f"{name.strip()} #{k} |{rest}")
+            else:
+                out.append(raw)
+    with open(dst_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(out) + "\n")
+
+def _time_ops(op, args_list, rounds=5, before_round=None):
+    """Time op(*args) for every args; of several rounds keep the one with the best p50,
+    which filters out noise from other processes on the machine."""
+    op(*args_list[0])           # warm caches outside the measurement
+    clock = time.perf_counter_ns
+    best = None
+    for _ in range(rounds):
+        if before_round:
+            before_round()
+        samples = []
+        for args in args_list:
+            t0 = clock()
+            op(*args)
+            samples.append(clock() - t0)
+        samples.sort()
+        pick = lambda q: samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))] / 1000.0
+        stats = {'ops': len(samples), 'ops_per_s': len(samples) * 1e9 / (sum(samples) or 1),
+                 'p50_us': pick(0.50), 'p99_us': pick(0.99)}
+        if best is None or stats['p50_us'] < best['p50_us']:
+            best = stats
+    return best
+
+def _typo(rnd, name):
+    s = list(search_key(name))
+    if len(s) > 3:
+        i = rnd.randrange(len(s) - 1)
+        s[i], s[i + 1] = s[i + 1], s[i]
+    return ''.join(s[:rnd.randint(3, max(3, len(s)))])
+
+def run_benchmarks(network=None, ops=300, seed=1234, enlarge=10):
+    network = network or get_network()
+    rnd = random.Random(seed)
+    names = sorted(network.station_index)
+    start, end = hhmm_to_min(START_SERVICE), hhmm_to_min(END_SERVICE)
+    times = [f"{m // 60:02d}:{m % 60:02d}" for m in (rnd.randrange(start, end) for _ in range(ops))]
+    results = {}
+
+    sink = io.StringIO()
+    def plan(src, dst, t):
+        with redirect_stdout(sink):
+            plan_journey_compact(network, src, dst, t)
+        sink.seek(0)
+        sink.truncate()
+    # the planner answers repeats from the plan cache; every round should plan afresh
+    results['plan'] = _time_ops(plan, [tuple(rnd.sample(names, 2)) + (t,) for t in times],
+                                before_round=clear_plan_cache)
+
+    def board(ln, station, minute):
+        line = network.lines[ln]
+        off_start, off_end, _ = find_station_offsets(line, station)
+        compute_next_arrivals(line_departures(line, True), off_start, minute, 6, line_service(line, True))
+        compute_next_arrivals(line_departures(line, False), off_end, minute, 6, line_service(line, False))
+    stops = [(ln, st) for ln, line in network.lines.items() for st in line.names]
+    results['arrivals'] = _time_ops(board, [rnd.choice(stops) + (rnd.randrange(start, end),) for _ in range(ops)])
+
+    # start every round with an empty memo so the index itself is measured
+    results['fuzzy'] = _time_ops(lambda q: suggest_stations(network, q),
+                                 [(_typo(rnd, rnd.choice(names)),) for _ in range(ops)],
+                                 before_round=get_name_index(network.station_index).memo.clear)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        big = os.path.join(tmp, "metro_data_x%d.txt" % enlarge)
+        enlarge_network_file(network.path, big, enlarge)
+        results[f'parse_x{enlarge}'] = _time_ops(load_network, [(big,)] * max(5, ops // 30), rounds=3)
+    return results
+
+def compare_benchmarks(results, baseline, threshold=BENCH_THRESHOLD):
+    """Names of workloads whose p50 regressed by more than threshold against baseline."""
+    return [name for name, r in results.items()
+            if name in baseline and r['p50_us'] > baseline[name]['p50_us'] * (1 + threshold)]
+
+def main_bench(baseline_path=BENCH_BASELINE_FILE, save=False, threshold=BENCH_THRESHOLD, ops=300):
+    results = run_benchmarks(ops=ops)
+    baseline = {}
+    if not save and os.path.exists(baseline_path):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(f"{'Workload':<12} {'ops/s':>10} {'p50 us':>10} {'p99 us':>10} {'base p50':>10}")
+    for name, r in results.items():
+        base = f"{baseline[name]['p50_us']:.1f}" if name in baseline else "-"
+        print(f"{name:<12} {r['ops_per_s']:>10.0f} {r['p50_us']:>10.1f} {r['p99_us']:>10.1f} {base:>10}")
+    if save:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+    regressed = compare_benchmarks(results, baseline, threshold)
+    if regressed:
+        print(f"REGRESSION (> {threshold:.0%} slower p50): {', '.join(regressed)}")
+        return 1
+    return 0
+
+# -------------------- instrumentation --------------------
+# Per-stage timers for production latency questions. enable_instrumentation() rebinds
+# the module-level functions of each stage to timing wrappers (every call inside the
+# module looks them up by name), and disable_instrumentation() puts the originals
+# back, so nothing is paid while it is off. A stage's time includes the other stages
+# it calls ('plan' is end to end); re-entering the same stage is not counted twice.
+# While tracemalloc is tracing (profile_capture('memory')), each stage also adds up
+# the bytes it left allocated. Metrics cover this process only, not batch workers.
+INSTRUMENTED_STAGES = (
+    ('parse', ('load_network', 'load_network_binary')),
+    ('match', ('match_station', 'find_best_line_match', 'find_station_offsets', 'suggest_stations')),
+    ('route', ('shortest_route', 'k_shortest_routes', 'csa_earliest_arrival', 'csa_profile')),
+    ('schedule', ('schedule_legs', 'compute_next_arrivals', 'station_arrivals', 'batch_next_arrivals')),
+    ('format', ('format_journey_plan', 'format_station_arrivals', 'format_batch_records', '_plan_json')),
+    ('plan', ('cached_plan_journey', 'plan_journey', 'journey_options', 'journey_alternatives')),
+    ('fare', ('trip_fare',)),
+)
+METRICS_FORMATS = ('json', 'prometheus')
+PROFILE_MODES = ('cpu', 'memory')
+
+_instrumented = {}      # function name -> original function
+_stage_metrics = {}     # stage -> [calls, seconds, max seconds, bytes]
+_stage_active = threading.local()
+
+def _timed_stage(stage, fn):
+    metric = _stage_metrics.setdefault(stage, [0, 0.0, 0.0, 0])
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        active = _stage_active.__dict__
+        if active.get(stage):
+            return fn(*args, **kwargs)
+        active[stage] = True
+        tracing = tracemalloc.is_tracing()
+        before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            active[stage] = False
+            metric[0] += 1
+            metric[1] += elapsed
+            if elapsed > metric[2]:
+                metric[2] = elapsed
+            if tracing:
+                metric[3] += tracemalloc.get_traced_memory()[0] - before
+    return wrapper
+
+def enable_instrumentation():
+    module = globals()
+    for stage, names in INSTRUMENTED_STAGES:
+        for name in names:
+            if name not in _instrumented:
+                _instrumented[name] = module[name]
+                module[name] = _timed_stage(stage, module[name])
+
+def disable_instrumentation():
+    module = globals()
+    for name, fn in _instrumented.items():
+        module[name] = fn
+    _instrumented.clear()
+
+def instrumentation_enabled():
+    return bool(_instrumented)
+
+def reset_metrics():
+    for metric in _stage_metrics.values():
+        metric[:] = [0, 0.0, 0.0, 0]
+
+def metrics_snapshot():
+    """{'enabled': bool, 'stages': {stage: {calls, seconds, max_seconds, bytes}},
+    'plan_cache': plan_cache_stats()}."""
+    stages = {stage: {'calls': m[0], 'seconds': m[1], 'max_seconds': m[2], 'bytes': m[3]}
+              for stage, m in _stage_metrics.items()}
+    return {'enabled': instrumentation_enabled(), 'stages': stages, 'plan_cache': plan_cache_stats()}
+
+def format_metrics(snapshot, fmt='json'):
+    """A metrics_snapshot() as JSON or Prometheus text exposition format."""
+    if fmt == 'json':
+        return json.dumps(snapshot, indent=2)
+    out = []
+    for field, kind, help_text in (('calls', 'counter', "Calls into each stage."),
+                                   ('seconds', 'counter', "Time spent in each stage."),
+                                   ('max_seconds', 'gauge', "Slowest single call of each stage."),
+                                   ('bytes', 'counter', "Bytes left allocated by each stage (tracemalloc).")):
+        name = f"metro_stage_{field}" + ("_total" if kind == 'counter' else "")
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for stage, values in snapshot['stages'].items():
+            out.append(f'{name}{{stage="{stage}"}} {values[field]}')
+    for field, value in snapshot['plan_cache'].items():
+        kind = 'gauge' if field in ('size', 'maxsize') else 'counter'
+        name = f"metro_plan_cache_{field}" + ("_total" if kind == 'counter' else "")
+        out.append(f"# TYPE {name} {kind}")
+        out.append(f"{name} {value}")
+    return "\n".join(out) + "\n"
+
+@contextmanager
+def profile_capture(mode, out_path=None):
+    """Profile the enclosed code: 'cpu' runs cProfile, 'memory' tracemalloc. Results go
+    to out_path (pstats or tracemalloc snapshot file) or as a summary to stderr."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"profile mode must be one of {', '.join(PROFILE_MODES)}")
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if out_path:
+                profiler.dump_stats(out_path)
+            else:
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
         return
-    print(f"Next metro at {min_to_hhmm(next_arr_src)}")
-    
-
-    # arrival at transfer (minutes using offsets)
-    offsets_a = lines_data[la]['offsets_from_start']
-    travel_offset_a = abs(offsets_a.get(transfer_point, 0.0) - offsets_a.get(src, 0.0))
-    arrival_transfer_time = next_arr_src + travel_offset_a + DWELL_TIME
-    layout_tf, parking_tf, ln_tf, _ = get_station_meta(lines_data, transfer_point)
-    print(f"Arrive at {transfer_point} at {min_to_hhmm(arrival_transfer_time)}, layout - {layout_tf}, Parking - {parking_tf}")
-
-    # transfer print
-    print(f"Transfer to {pretty_line(lb)}")
-    ready_for_line2 = arrival_transfer_time + INTERCHANGE_TIME
-
-    # next train on second line
-    stations_b = [s['name'] for s in lines_data[lb]['stations']]
-    idx_transfer_b = stations_b.index(transfer_point); idx_dest_b = stations_b.index(best_path[-1])
-    towards_end_b = idx_dest_b > idx_transfer_b
-    next_arr_b = next_train_at_station_for_direction(lines_data[lb]['stations'], transfer_point, ready_for_line2, towards_end_b)
-    if next_arr_b is None:
-        print("Next connecting metro: No service")
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if out_path:
+            snapshot.dump(out_path)
+        else:
+            print(f"Peak traced memory: {peak / 1024:.1f} KiB", file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:15]:
+                print(stat, file=sys.stderr)
+
+# -------------------- batch planning --------------------
+# Plans (from, to, time) queries from a CSV or JSONL file with the network loaded once and
+# writes one flat record per input row, in input order. Rows are read, planned and written
+# a chunk at a time (in worker processes with --workers, a bounded number of chunks in
+# flight), so memory stays flat however large the file is. Each process memoizes routes
+# per station pair, which is at most stations^2 small tuples.
+BATCH_CHUNK = 2000
+BATCH_FIELDS = ('from', 'to', 'time', 'status', 'src', 'dst', 'departs', 'arrives',
+                'travel_minutes', 'transfers', 'distance_km', 'fare')
+
+def batch_format(path):
+    return 'jsonl' if path and path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+INVALID_BATCH_ROW = (None, None, None)
+
+def read_batch_queries(f, fmt):
+    """Yield (from, to, time) strings from a JSONL stream ({"from", "to", "time"} objects)
+    or a CSV stream (with a from,to,time header, otherwise the first three columns).
+    A JSONL line that is not an object yields INVALID_BATCH_ROW, so it gets a record of
+    its own and the rest of the file is still planned."""
+    if fmt == 'jsonl':
+        for line in f:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if not isinstance(row, dict):
+                    yield INVALID_BATCH_ROW
+                    continue
+                yield tuple(str(row.get(k, '')) for k in ('from', 'to', 'time'))
         return
-    print(f"Next {pretty_line(lb)} metro departs at {min_to_hhmm(next_arr_b)}, layout - {layout_tf}, Parking - {parking_tf}")
-
-    # arrival at destination
-    offsets_b = lines_data[lb]['offsets_from_start']
-    travel_offset_b = abs(offsets_b.get(best_path[-1], 0.0) - offsets_b.get(transfer_point, 0.0))
-    arrival_dest_time = next_arr_b + travel_offset_b + DWELL_TIME
-
-
-    layout_dst, parking_dst, ln_dst, _ = get_station_meta(lines_data, best_path[-1])
-    print(f"Arrive at {best_path[-1]} at {min_to_hhmm(arrival_dest_time)}, layout - {layout_dst}, Parking - {parking_dst}")
-
-    # compute distance: sum legs' distances
-    dist_a = compute_distance_on_line(lines_data, la, src, transfer_point)
-    dist_b = compute_distance_on_line(lines_data, lb, transfer_point, best_path[-1])
-    total_dist = dist_a + dist_b
-    print(f"Total distance: {total_dist:.2f} km")
-
-    fare = fare_by_distance_km(total_dist)
-    total_minutes = int(round(arrival_dest_time - start_min))
-    print(f"Total travel time: {total_minutes} minutes")
-    print(f"Fare: ₹{fare}")
-    return
+    reader = csv.reader(f)
+    first = next(reader, None)
+    if first is None:
+        return
+    header = [c.strip().lower() for c in first]
+    if {'from', 'to', 'time'} <= set(header):
+        cols = [header.index(k) for k in ('from', 'to', 'time')]
+    else:
+        cols = [0, 1, 2]
+        reader = chain([first], reader)
+    for row in reader:
+        if row:
+            yield tuple(row[c] if c < len(row) else '' for c in cols)
+
+def batch_plan_record(network, query, config=None, routes=None, router='timetable'):
+    """Flat dict (BATCH_FIELDS) for one (from, to, time) query."""
+    src_pref, dst_pref, when = query
+    record = dict.fromkeys(BATCH_FIELDS)
+    if query == INVALID_BATCH_ROW:
+        record['status'] = 'invalid_row'
+        return record
+    record.update({'from': src_pref, 'to': dst_pref, 'time': when})
+    try:
+        plan = plan_journey(network, src_pref, dst_pref, when, config, routes, router)
+    except ValueError:
+        record['status'] = 'invalid_time'
+        return record
+    record.update({'status': plan.status, 'src': plan.src, 'dst': plan.dst})
+    if plan.status in ('ok', 'no_service'):
+        record.update({'transfers': len(plan.legs) - 1, 'distance_km': round(plan.distance, 2),
+                       'fare': plan.fare, 'travel_minutes': plan.travel_minutes})
+        if plan.legs and plan.legs[0].departs is not None:
+            record['departs'] = min_to_hhmm(plan.legs[0].departs)
+        if plan.status == 'ok' and plan.legs:
+            record['arrives'] = min_to_hhmm(plan.legs[-1].arrives)
+    return record
+
+def format_batch_records(records, fmt):
+    if fmt == 'jsonl':
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    for r in records:
+        writer.writerow(['' if r[k] is None else r[k] for k in BATCH_FIELDS])
+    return buf.getvalue()
+
+_batch_worker = {}
+
+def _init_batch_worker(path):
+    _batch_worker['network'] = get_network(path)
+    _batch_worker['routes'] = {}
+
+def _plan_batch_chunk(chunk, fmt, router='timetable'):
+    network, routes = _batch_worker['network'], _batch_worker['routes']
+    return format_batch_records([batch_plan_record(network, q, routes=routes, router=router)
+                                 for q in chunk], fmt)
+
+def run_batch(in_f, out_f, in_fmt='csv', out_fmt='csv', workers=0, network=None, chunk=BATCH_CHUNK,
+              router='timetable'):
+    """Plan every query read from in_f and write the records to out_f; returns the row count.
+    The default timetable router finds the earliest arrival, as the interactive planner
+    does; router='static' is a few times faster (routes are memoized per pair) but can
+    arrive later, since it fixes the route before looking at the trains."""
+    network = network or get_network()
+    queries = read_batch_queries(in_f, in_fmt)
+    chunks = iter(lambda: list(islice(queries, chunk)), [])
+    if out_fmt == 'csv':
+        out_f.write(",".join(BATCH_FIELDS) + "\n")
+    rows = 0
+    if workers <= 1:
+        _init_batch_worker(network.path)
+        for part in chunks:
+            out_f.write(_plan_batch_chunk(part, out_fmt, router))
+            rows += len(part)
+        return rows
+    _network_cache.setdefault(network.path, network)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(network.path,)) as pool:
+        pending = deque()
+        for part in chunks:
+            pending.append(pool.submit(_plan_batch_chunk, part, out_fmt, router))
+            rows += len(part)
+            # keep a few chunks per worker in flight; write finished ones in input order
+            if len(pending) >= workers * 4:
+                out_f.write(pending.popleft().result())
+        while pending:
+            out_f.write(pending.popleft().result())
+    return rows
+
+def main_batch(in_path, out_path=None, workers=0, in_fmt=None, out_fmt=None, router='timetable'):
+    in_fmt = in_fmt or batch_format(in_path)
+    out_fmt = out_fmt or (batch_format(out_path) if out_path else in_fmt)
+    t0 = time.perf_counter()
+    with open(in_path, 'r', encoding='utf-8', newline='') as in_f:
+        if out_path:
+            with open(out_path, 'w', encoding='utf-8', newline='') as out_f:
+                rows = run_batch(in_f, out_f, in_fmt, out_fmt, workers, router=router)
+        else:
+            rows = run_batch(in_f, sys.stdout, in_fmt, out_fmt, workers, router=router)
+    elapsed = time.perf_counter() - t0
+    print(f"Planned {rows} queries in {elapsed:.2f}s ({rows / (elapsed or 1e-9):.0f}/s)", file=sys.stderr)
+
+# -------------------- HTTP query service --------------------
+# asyncio HTTP/1.1 server (stdlib only) answering GET requests with JSON, for callers
+# that cannot drive the input() menus. The network, station graph, name indexes and
+# timetables are built once at startup; every handler is plain synchronous code that
+# takes well under a millisecond, so one event loop serves many keep-alive clients.
+#   GET /arrivals?line=BLUE LINE - MAIN&station=rajiv&time=09:18[&limit=6]
+#   GET /plan?from=kashmere&to=hauz khas&time=09:00[&router=timetable|static][&alternatives=2]
+#   GET /departures?from=kashmere&to=hauz khas&start=08:00&end=10:00[&router=...]
+#   GET /fare?from=kashmere&to=hauz khas[&time=14:30][&payment=token|card]
+# Bad or missing parameters answer 400, unknown stations/lines/routes 404, and a
+# handler that fails any other way 500 (the traceback goes to stderr).
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8080
+MAX_API_ALTERNATIVES = 5
+MAX_API_ARRIVALS = 30
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+def _query_param(params, name, default=None):
+    values = params.get(name)
+    if values and values[0].strip():
+        return values[0].strip()
+    if default is None:
+        raise ValueError(f"Missing query parameter '{name}'.")
+    return default
+
+def _query_time(params, name='time'):
+    text = _query_param(params, name)
+    h, _, m = text.partition(':')
+    if not (h.isdigit() and m.isdigit() and int(h) < 24 and int(m) < 60):
+        raise ValueError(f"'{name}' must be HH:MM between 00:00 and 23:59, got '{text}'.")
+    return int(h) * 60 + int(m)
+
+def api_arrivals(network, params, config):
+    line_key = find_best_line_match(network.lines, _query_param(params, 'line'))
+    if not line_key:
+        raise LookupError("No matching line found.")
+    line = network.lines[line_key]
+    off_start, off_end, station = find_station_offsets(line, _query_param(params, 'station'))
+    if off_start is None:
+        raise LookupError(f"Station not found on {line_key}.")
+    limit = _query_param(params, 'limit', '6')
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_API_ARRIVALS:
+        raise ValueError(f"'limit' must be 1-{MAX_API_ARRIVALS}, got '{limit}'.")
+    result = station_arrivals(line, station, _query_time(params), int(limit), config)
+    board = lambda d: {'terminal': d.terminal, 'arrivals': [min_to_hhmm(a) for a in d.arrivals]}
+    return 200, {'line': result.line, 'station': result.station, 'time': min_to_hhmm(result.time),
+                 'towards_end': board(result.towards_end), 'towards_start': board(result.towards_start)}
+
+def api_plan(network, params, config):
+    plan = cached_plan_journey(network, _query_param(params, 'from'), _query_param(params, 'to'),
+                               _query_time(params), config, _query_param(params, 'router', 'timetable'))
+    if plan.status == 'no_station':
+        raise LookupError("Station not found.")
+    if plan.status == 'no_route':
+        raise LookupError("No route found.")
+    if plan.status == 'outside_hours':
+        first, last = get_service_window(network, config)
+        raise ValueError(f"Requested time {min_to_hhmm(plan.start)} is outside service hours "
+                         f"({min_to_ampm(first)} to {min_to_ampm(last)}).")
+    body = _plan_json(plan)
+    k = _query_param(params, 'alternatives', '0')
+    if not k.isdigit() or int(k) > MAX_API_ALTERNATIVES:
+        raise ValueError(f"'alternatives' must be 0-{MAX_API_ALTERNATIVES}, got '{k}'.")
+    if int(k):
+        # one extra route, since the plan's own is usually among them
+        others = journey_alternatives(network, plan.src, plan.dst, plan.start, int(k) + 1, config)
+        route = _plan_route(plan)
+        body['alternatives'] = [_plan_json(p) for p in others.plans if _plan_route(p) != route][:int(k)]
+    return 200, body
+
+def _plan_json(plan):
+    hhmm = lambda m: min_to_hhmm(m) if m is not None else None
+    legs = [{'line': leg.line, 'board': leg.board, 'alight': leg.alight,
+             'departs': hhmm(leg.departs), 'arrives': hhmm(leg.arrives),
+             'layout': leg.meta.layout, 'parking': leg.meta.parking} for leg in plan.legs]
+    return {'from': plan.src, 'to': plan.dst, 'time': min_to_hhmm(plan.start),
+            'complete': plan.status == 'ok', 'legs': legs, 'distance_km': round(plan.distance, 2),
+            'travel_minutes': plan.travel_minutes, 'fare': plan.fare}
+
+def api_departures(network, params, config):
+    start, end = _query_time(params, 'start'), _query_time(params, 'end')
+    if end < start:
+        raise ValueError(f"'end' ({min_to_hhmm(end)}) is before 'start' ({min_to_hhmm(start)}).")
+    result = journey_options(network, _query_param(params, 'from'), _query_param(params, 'to'),
+                             start, end, config, router=_query_param(params, 'router', 'static'))
+    if result.status == 'no_station':
+        raise LookupError("Station not found.")
+    if result.status == 'no_route':
+        raise LookupError("No route found.")
+    if result.status == 'outside_hours':
+        first, last = get_service_window(network, config)
+        raise ValueError(f"Window is outside service hours ({min_to_ampm(first)} to {min_to_ampm(last)}).")
+    return 200, {'from': result.src, 'to': result.dst, 'start': min_to_hhmm(result.window_start),
+                 'end': min_to_hhmm(result.window_end),
+                 'options': [_plan_json(plan) for plan in result.options]}
+
+def api_fare(network, params, config):
+    payment = _query_param(params, 'payment', 'token')
+    if payment not in PAYMENT_TYPES:
+        raise ValueError(f"'payment' must be one of {', '.join(PAYMENT_TYPES)}.")
+    tap_in = _query_time(params) if 'time' in params else None
+    result = trip_fare(network, _query_param(params, 'from'), _query_param(params, 'to'),
+                       tap_in, payment, config)
+    if result.status == 'no_station':
+        raise LookupError("Station not found.")
+    if result.status == 'no_route':
+        raise LookupError("No route found.")
+    return 200, {'from': result.src, 'to': result.dst, 'distance_km': round(result.distance, 2),
+                 'fare': result.fare, 'base_fare': result.base, 'payment': payment,
+                 'peak': result.peak}
+
+def api_metrics(network, params, config):
+    fmt = _query_param(params, 'format', 'json')
+    if fmt not in METRICS_FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(METRICS_FORMATS)}.")
+    snapshot = metrics_snapshot()
+    return 200, (snapshot if fmt == 'json' else format_metrics(snapshot, fmt))
+
+API_ROUTES = {'/arrivals': api_arrivals, '/plan': api_plan, '/departures': api_departures,
+              '/fare': api_fare, '/metrics': api_metrics}
+
+def handle_api_request(network, method, target, config=None):
+    """(status, JSON-ready body) for one request line; needs no socket, so it is also
+    the entry point for testing the endpoints."""
+    config = config or current_config()
+    if method != 'GET':
+        return 405, {'error': f"Method {method} not allowed."}
+    url = urlsplit(target)
+    handler = API_ROUTES.get(url.path.rstrip('/'))
+    if handler is None:
+        return 404, {'error': f"Unknown endpoint {url.path}.", 'endpoints': sorted(API_ROUTES)}
+    params = parse_qs(url.query)
+    day = _query_param(params, 'day', config.day)
+    if day not in DAY_TYPES:
+        return 400, {'error': f"'day' must be one of {', '.join(DAY_TYPES)}."}
+    try:
+        return handler(network, params, config._replace(day=day))
+    except LookupError as e:
+        return 404, {'error': str(e.args[0])}
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        return 500, {'error': "Internal error while handling the request."}
+
+async def _serve_connection(path, config, reader, writer):
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+            lines = head.decode('latin-1').split("\r\n")
+            parts = lines[0].split()
+            if len(parts) != 3:
+                break
+            method, target, version = parts
+            headers = {}
+            for raw in lines[1:]:
+                name, _, value = raw.partition(':')
+                if name:
+                    headers[name.strip().lower()] = value.strip()
+            length = headers.get('content-length') or '0'
+            if length.isdigit():
+                if int(length):
+                    await reader.readexactly(int(length))   # bodies are not used
+                status, body = handle_api_request(_network_cache[path], method, target, config)
+            else:
+                # the body cannot be skipped without its length, so answer and close
+                status, body = 400, {'error': f"Bad Content-Length '{length}'."}
+                headers['connection'] = 'close'
+            # text bodies (Prometheus metrics) go out as they are, everything else as JSON
+            if isinstance(body, str):
+                data, ctype = body.encode('utf-8'), "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                data, ctype = json.dumps(body, ensure_ascii=False).encode('utf-8'), "application/json; charset=utf-8"
+            conn = headers.get('connection', '').lower()
+            keep = conn == 'keep-alive' if version == 'HTTP/1.0' else conn != 'close'
+            writer.write((f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                          f"Content-Type: {ctype}\r\n"
+                          f"Content-Length: {len(data)}\r\n"
+                          f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n").encode('latin-1') + data)
+            await writer.drain()
+            if not keep:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def start_api_server(network=None, host=SERVE_HOST, port=SERVE_PORT, config=None):
+    """Warm every cache a request touches, then return the listening asyncio server
+    (port=0 picks a free port, see server.sockets[0].getsockname()). Each request uses
+    the network currently cached for the data file, so reloads (watch_network) apply to
+    the next request while requests in progress finish on the network they started with."""
+    network = network or get_network()
+    config = config or current_config()
+    _network_cache.setdefault(network.path, network)
+    warm_network_caches(network, config)
+    return await asyncio.start_server(lambda r, w: _serve_connection(network.path, config, r, w),
+                                      host, port, backlog=1024)
+
+def main_serve(host=SERVE_HOST, port=SERVE_PORT, watch=2.0):
+    def reloaded(network, changed):
+        print(f"Reloaded {network.path}: {', '.join(changed)}", file=sys.stderr)
+        if warnings_note(network):
+            print(warnings_note(network), file=sys.stderr)
+    async def run():
+        if warnings_note(get_network()):
+            print(warnings_note(get_network()), file=sys.stderr)
+        server = await start_api_server(host=host, port=port)
+        print(f"Serving metro API on http://{host}:{server.sockets[0].getsockname()[1]} "
+              f"({', '.join(sorted(API_ROUTES))})")
+        if watch:
+            watch_network(interval=watch, on_reload=reloaded)
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Server stopped.")
 
 # -------------------- interactive main --------------------
 def main_ride():
-    lines_data, station_index = parse_metro_file2(METRO_FILE)
-    print("Using metro data file:", METRO_FILE)
+    network = refresh_network()[0]
+    print("Using metro data file:", network.path)
     src = input("Source: ").strip()
     dst = input("Destination: ").strip()
     t = input("Time of travel (HH:MM In 24 Hour Format): ").strip()
-    plan_journey_compact(lines_data, station_index, src, dst, t)
+    plan_journey_compact(network, src, dst, t)
 
 
 
@@ -756,8 +3507,81 @@ def main():
         else:
             print("Invalid choice. Try again.")
 
-if __name__ == "__main__":
-    main()
-
-
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Delhi Metro route and schedule simulator. "
+                                                 "Without a command, starts the interactive menu.")
+    parser.add_argument('--metrics', choices=METRICS_FORMATS, default=os.environ.get('METRO_METRICS') or None,
+                        help="time each stage and print the totals to stderr on exit (env METRO_METRICS)")
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=os.environ.get('METRO_PROFILE') or None,
+                        help="run under cProfile (cpu) or tracemalloc (memory) (env METRO_PROFILE)")
+    parser.add_argument('--profile-out', metavar='FILE',
+                        help="write the profile here instead of a summary on stderr")
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('precompute', help="build the all-pairs route matrix cache")
+    sub.add_parser('compile', help="compile the data file into a fast-loading binary network")
+    sub.add_parser('check', help="list interchanges and data file warnings")
+    sub.add_parser('scenarios', help="run a sample headway / timing scenario sweep")
+    headways = sub.add_parser('headways', help="choose per-line peak/off-peak headways for a fleet size")
+    headways.add_argument('--fleet', type=int, help="trains available (default: what the current headways need)")
+    headways.add_argument('--train-hour-cost', type=float, default=0.0,
+                          help="rider-minutes of waiting one train-hour of service is worth")
+    batch = sub.add_parser('batch', help="plan (from, to, time) queries from a CSV or JSONL file")
+    batch.add_argument('input', help="queries file (.csv with from,to,time columns, or .jsonl)")
+    batch.add_argument('-o', '--output', help="results file (default: stdout)")
+    batch.add_argument('--workers', type=int, default=0, help="worker processes (default: plan in-process)")
+    batch.add_argument('--input-format', choices=('csv', 'jsonl'))
+    batch.add_argument('--output-format', choices=('csv', 'jsonl'))
+    batch.add_argument('--router', choices=ROUTERS, default='timetable',
+                       help="timetable (earliest arrival) or static (faster, memoized per station pair)")
+    serve = sub.add_parser('serve', help="run the JSON HTTP API (arrivals, plan, fare)")
+    serve.add_argument('--host', default=SERVE_HOST)
+    serve.add_argument('--port', type=int, default=SERVE_PORT)
+    serve.add_argument('--watch', type=float, default=2.0, metavar='SECONDS',
+                       help="reload the data file when it changes, polling this often (0: off)")
+    disrupt = sub.add_parser('disrupt', help="apply live delay / closure events from a JSON-lines feed")
+    disrupt.add_argument('events', nargs='?', help="events file (default: stdin)")
+    bench = sub.add_parser('bench', help="benchmark hot paths, optionally against a baseline")
+    bench.add_argument('--baseline', default=BENCH_BASELINE_FILE)
+    bench.add_argument('--save-baseline', action='store_true')
+    bench.add_argument('--threshold', type=float, default=BENCH_THRESHOLD)
+    bench.add_argument('--ops', type=int, default=300)
+    args = parser.parse_args(argv)
+    # defaults from the environment bypass argparse's choices check
+    if args.metrics not in (None,) + METRICS_FORMATS or args.profile not in (None,) + PROFILE_MODES:
+        parser.error(f"METRO_METRICS must be one of {', '.join(METRICS_FORMATS)} and "
+                     f"METRO_PROFILE one of {', '.join(PROFILE_MODES)}")
+    if args.metrics:
+        enable_instrumentation()
+    try:
+        with profile_capture(args.profile, args.profile_out) if args.profile else nullcontext():
+            return run_command(args)
+    finally:
+        if args.metrics:
+            print(format_metrics(metrics_snapshot(), args.metrics), file=sys.stderr)
+
+def run_command(args):
+    if args.command == 'precompute':
+        main_precompute()
+    elif args.command == 'compile':
+        main_compile()
+    elif args.command == 'check':
+        return main_check()
+    elif args.command == 'scenarios':
+        main_scenarios()
+    elif args.command == 'headways':
+        main_headways(args.fleet, args.train_hour_cost)
+    elif args.command == 'batch':
+        main_batch(args.input, args.output, args.workers, args.input_format, args.output_format,
+                   args.router)
+    elif args.command == 'serve':
+        main_serve(args.host, args.port, args.watch)
+    elif args.command == 'disrupt':
+        main_disrupt(args.events)
+    elif args.command == 'bench':
+        return main_bench(args.baseline, args.save_baseline, args.threshold, args.ops)
+    else:
+        main()
+    return 0
 
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,452 @@
+"""Behaviour checks for the metro simulator, one group per feature.
+
+Run with `python -m pytest -q` next to metro_data.txt. The simulator's file name starts
+with a digit, so it is loaded from its path rather than imported by name.
+"""
+import csv
+import importlib.util
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_simulator():
+    spec = importlib.util.spec_from_file_location(
+        "metro_simulator", os.path.join(HERE, "2023241_metro_simulator.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+metro = _load_simulator()
+DATA_FILE = os.path.join(HERE, metro.METRO_FILE)
+
+
+@pytest.fixture(scope="module")
+def network():
+    return metro.load_network(DATA_FILE)
+
+
+@pytest.fixture(scope="module")
+def queries(network):
+    rnd = random.Random(7)
+    names = sorted(network.station_index)
+    return [tuple(rnd.sample(names, 2)) + (rnd.randrange(360, 1380),) for _ in range(150)]
+
+
+# -------------------- connection scan routing --------------------
+def test_csa_matches_static_schedule(network, queries):
+    timetable = metro.get_timetable(network)
+    graph = metro.get_station_graph(network)
+    for src, dst, start in queries:
+        legs = metro.csa_earliest_arrival(timetable, src, dst, start)
+        path, _ = metro.shortest_route(graph, network.station_index, src, dst)
+        static = metro.schedule_legs(network, metro.route_legs(path), start)
+        complete = len(static) == len(metro.route_legs(path))
+        if legs is None:
+            assert not complete, (src, dst, start)
+            continue
+        # the legs replay to the same times, and never arrive later than the static route
+        replay = metro.schedule_legs(network, [leg[:3] for leg in legs], start)
+        assert [tuple(leg) for leg in replay] == [tuple(leg) for leg in legs]
+        if complete:
+            assert legs[-1][4] <= static[-1][4]
+
+
+def test_csa_profile_matches_earliest_arrival(network, queries):
+    timetable = metro.get_timetable(network)
+    rnd = random.Random(11)
+    for src, dst, _ in queries[:40]:
+        start = rnd.randrange(360, 1200)
+        end = start + rnd.randrange(10, 120)
+        profile = metro.csa_profile(timetable, src, dst, start, end)
+        assert profile == sorted(profile)
+        for minute in range(start, end + 1, 3):
+            legs = metro.csa_earliest_arrival(timetable, src, dst, minute)
+            later = [p for p in profile if p[0] >= minute]
+            if legs is None:
+                assert not later, (src, dst, minute)
+            elif legs[0][3] <= end:
+                assert later and later[0][1] == legs[-1][4], (src, dst, minute)
+            elif later:
+                # the earliest arrival is also reached by leaving inside the window
+                assert later[0][1] == legs[-1][4], (src, dst, minute)
+
+
+# -------------------- compiled network file --------------------
+def test_binary_network_round_trip(network, tmp_path):
+    path = str(tmp_path / "metro_data.bin")
+    digest = metro.data_file_digest(DATA_FILE)
+    metro.save_network_binary(network, path, digest)
+    loaded = metro.load_network_binary(path, digest, DATA_FILE)
+    assert loaded is not None
+    assert list(loaded.lines) == list(network.lines)
+    for key, line in network.lines.items():
+        assert loaded.lines[key] == line, key
+    assert loaded.station_index == network.station_index
+    assert loaded.sections == network.sections
+    assert loaded.interchanges == network.interchanges
+    # a stale digest or a truncated file is not used
+    assert metro.load_network_binary(path, bytes(32), DATA_FILE) is None
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    assert metro.load_network_binary(path, digest, DATA_FILE) is None
+
+
+# -------------------- disruptions --------------------
+def test_hold_retimes_following_stations(network):
+    state = metro.disruption_state(network)
+    line = network.lines['BLUE LINE - MAIN']
+    downstream = line.names[line.index['Rajiv Chowk'] + 2]
+    before = metro.station_arrivals(line, downstream, 540)
+    changed = metro.hold_train(state, line.key, True, 'Rajiv Chowk', 540, 10)
+    assert changed
+    after = metro.disrupted_arrivals(state, line, downstream, 540)
+    # the held train runs 10 minutes late and the trains behind it never overtake it
+    delays = [b - a for a, b in zip(before.towards_end.arrivals, after.towards_end.arrivals)]
+    assert all(d >= 0 for d in delays)
+    assert next(d for d in delays if d) == 10
+    assert after.towards_start == before.towards_start
+    timetable = metro.disrupted_timetable(state)
+    assert list(timetable.dep) == sorted(timetable.dep)
+    assert len(timetable.dep) == len(state.timetable.dep)
+    metro.clear_disruptions(state)
+    assert metro.disrupted_arrivals(state, line, downstream, 540) == before
+
+
+def test_disrupted_plan_same_station(network):
+    state = metro.disruption_state(network)
+    plan = metro.plan_journey(network, 'Rajiv Chowk', 'Rajiv Chowk', '09:00', disruption=state)
+    assert plan.status == 'ok'
+    assert plan.legs == ()
+
+
+# -------------------- plan cache --------------------
+@pytest.mark.parametrize("router", ["static", "timetable"])
+def test_cached_plans_match_fresh_plans(network, queries, router):
+    cache = metro.new_plan_cache(256)
+    # each query twice, so the second one is answered from the cache
+    for src, dst, start in queries + queries[:50]:
+        cached = metro.cached_plan_journey(network, src, dst, start, router=router, cache=cache)
+        assert cached == metro.plan_journey(network, src, dst, start, router=router)
+    assert metro.plan_cache_stats(cache)['hits'] > 0
+
+
+def test_plan_cache_evicts_and_resets_for_a_new_network(network):
+    cache = metro.new_plan_cache(2)
+    for dst in ('Rajiv Chowk', 'Mandi House', 'Hauz Khas'):
+        metro.cached_plan_journey(network, 'Kashmere Gate', dst, '09:00', cache=cache)
+    assert metro.plan_cache_stats(cache)['evictions'] == 1
+    metro.cached_plan_journey(metro.load_network(DATA_FILE), 'Kashmere Gate', 'Hauz Khas', '09:00', cache=cache)
+    stats = metro.plan_cache_stats(cache)
+    assert stats['invalidations'] == 1 and stats['size'] == 1
+
+
+# -------------------- fares --------------------
+def test_fare_slabs_and_discounts_round_to_whole_rupees():
+    table = metro.make_fare_table(((2.0, 10), (None, 25)), (('card', 'any', 10), ('card', 'offpeak', 10)))
+    # a slab limit is inclusive, even after float drift in summed distances
+    assert metro.fare_slab(0.1 + 0.2 + 1.7, table) == 0
+    assert metro.fare_slab(2.05, table) == 1
+    assert table.prices[('token', True)] == (10, 25)
+    # 25 * 0.9 = 22.5 rounds up, 25 * 0.8 = 20
+    assert table.prices[('card', True)] == (9, 23)
+    assert table.prices[('card', False)] == (8, 20)
+    with pytest.raises(ValueError):
+        metro.make_fare_table(((None, 10),), (('cash', 'any', 10),))
+
+
+def test_trip_fare_applies_off_peak_card_discount(network):
+    peak = metro.trip_fare(network, 'Kashmere Gate', 'Hauz Khas', '09:00', 'card')
+    offpeak = metro.trip_fare(network, 'Kashmere Gate', 'Hauz Khas', '14:30', 'card')
+    token = metro.trip_fare(network, 'Kashmere Gate', 'Hauz Khas', None, 'token')
+    assert peak.peak and not offpeak.peak and token.peak
+    assert peak.base == offpeak.base == token.fare
+    assert (peak.fare, offpeak.fare) == (int(token.fare * 0.9 + 0.5), int(token.fare * 0.8 + 0.5))
+
+
+@pytest.mark.parametrize("router", ["static", "timetable"])
+def test_plans_charge_the_fare_endpoint_price(network, queries, router):
+    for src, dst, start in queries:
+        plan = metro.plan_journey(network, src, dst, start, router=router)
+        if plan.status not in ('ok', 'no_service'):
+            continue
+        assert plan.fare == metro.trip_fare(network, src, dst).base, (src, dst, start)
+
+
+def test_route_matrix_key_ignores_hours_headways_and_day(network):
+    config = metro.current_config()
+    digest = metro.route_matrix_digest(network, config)
+    assert metro.route_matrix_digest(network, config._replace(day='weekend', peak_freq=3)) == digest
+    assert metro.route_matrix_digest(network, config._replace(dwell=config.dwell + 1)) != digest
+
+
+def test_warming_builds_the_route_matrix():
+    network = metro.load_network(DATA_FILE)
+    metro.warm_network_caches(network)
+    assert any(hit[0] is network for hit in metro._route_matrix_cache.values())
+
+
+# -------------------- HTTP API --------------------
+@pytest.mark.parametrize("target, status", [
+    ("/plan?from=kashmere&to=hauz khas&time=09:00", 200),
+    ("/plan?from=kashmere&to=hauz khas&time=9:99", 400),
+    ("/plan?from=kashmere&to=hauz khas&time=25:00", 400),
+    ("/plan?from=kashmere&to=hauz khas&time=-1:00", 400),
+    ("/plan?from=kashmere&to=hauz khas&time=02:00", 400),
+    ("/plan?from=kashmere&to=nowhere&time=09:00", 404),
+    ("/plan?from=kashmere&to=hauz khas&time=09:00&alternatives=9", 400),
+    ("/arrivals?line=blue&station=rajiv&time=09:00&limit=3", 200),
+    ("/arrivals?line=blue&station=rajiv&time=09:00&limit=abc", 400),
+    ("/arrivals?line=blue&station=rajiv&time=09:00&limit=-3", 400),
+    ("/arrivals?line=no such line&station=rajiv&time=09:00", 404),
+    ("/departures?from=kashmere&to=hauz khas&start=08:00&end=09:00", 200),
+    ("/departures?from=kashmere&to=hauz khas&start=10:00&end=09:00", 400),
+    ("/fare?from=kashmere&to=hauz khas&payment=cash", 400),
+    ("/fare?from=kashmere", 400),
+    ("/nope", 404),
+])
+def test_api_status_codes(network, target, status):
+    assert metro.handle_api_request(network, 'GET', target)[0] == status
+
+
+def test_api_rejects_bad_times_by_name(network):
+    status, body = metro.handle_api_request(network, 'GET', "/plan?from=kashmere&to=hauz khas&time=9:99")
+    assert status == 400 and "'time'" in body['error']
+    status, body = metro.handle_api_request(
+        network, 'GET', "/departures?from=kashmere&to=hauz khas&start=10:00&end=09:00")
+    assert status == 400 and "'end'" in body['error']
+
+
+def test_api_reports_handler_failures_as_500(network, monkeypatch, capsys):
+    monkeypatch.setitem(metro.API_ROUTES, '/fare', lambda *args: 1 / 0)
+    status, body = metro.handle_api_request(network, 'GET', "/fare?from=kashmere&to=hauz khas")
+    assert status == 500 and 'error' in body
+    assert 'ZeroDivisionError' in capsys.readouterr().err
+    assert metro.handle_api_request(network, 'POST', "/fare")[0] == 405
+
+
+# -------------------- reloads --------------------
+def _edit_data_file(path, old, new):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text.replace(old, new, 1))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def test_watcher_reloads_only_the_edited_line(tmp_path):
+    path = str(tmp_path / "metro_data.txt")
+    with open(DATA_FILE, encoding='utf-8') as src, open(path, 'w', encoding='utf-8') as dst:
+        dst.write(src.read())
+    old = metro.get_network(path)
+    reloaded = []
+    done = threading.Event()
+    stop = metro.watch_network(path, 0.05, lambda net, changed: (reloaded.append((net, changed)), done.set()))
+    try:
+        _edit_data_file(path, "Dwarka Sector 8 | 2 |", "Dwarka Sector 8 | 3 |")
+        assert done.wait(10)
+    finally:
+        stop.set()
+    new, changed = reloaded[0]
+    assert changed == ('BLUE LINE - MAIN',)
+    assert metro.get_network(path) is new
+    assert new.lines['BLUE LINE - MAIN'].total_length == old.lines['BLUE LINE - MAIN'].total_length + 1
+    assert all(new.lines[k] is old.lines[k] for k in old.lines if k not in changed)
+    # nothing changed since, so the next poll keeps the network
+    assert metro.refresh_network(path) == (new, ())
+
+
+def test_network_caches_stay_bounded_under_concurrent_builds(network):
+    cache = {}
+    networks = [network] + [metro.load_network(DATA_FILE) for _ in range(3)]
+    config = metro.current_config()
+    errors = []
+    def fill():
+        try:
+            for _ in range(200):
+                for net in networks:
+                    metro.cached_for_network(cache, net, config, lambda n, c: n.path)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=fill) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(cache) <= 2
+
+
+# -------------------- departure windows --------------------
+@pytest.mark.parametrize("router", ["static", "timetable"])
+def test_departure_options_are_plans_none_of_which_is_beaten(network, queries, router):
+    for src, dst, start in queries[:40]:
+        result = metro.journey_options(network, src, dst, start, start + 90, router=router)
+        assert result.status in ('ok', 'outside_hours'), (src, dst, start)
+        arrivals = [p.legs[-1].arrives for p in result.options]
+        departures = [p.start for p in result.options]
+        # later departures arrive strictly later
+        assert departures == sorted(departures) and arrivals == sorted(set(arrivals))
+        for plan in result.options:
+            fresh = metro.plan_journey(network, src, dst, plan.start, router=router)
+            # the timetable router may break ties in arrival time on another route
+            assert plan.legs[-1].arrives == fresh.legs[-1].arrives
+            assert plan == fresh or router == 'timetable'
+
+
+# -------------------- batch planning --------------------
+def _run_batch(text, **kwargs):
+    out = io.StringIO()
+    rows = metro.run_batch(io.StringIO(text), out, **kwargs)
+    return rows, out.getvalue()
+
+
+def test_batch_defaults_to_the_earliest_arrival(network, queries):
+    text = "from,to,time\n" + "".join(f"{a},{b},{metro.min_to_hhmm(t)}\n" for a, b, t in queries)
+    _, default = _run_batch(text, network=network)
+    _, static = _run_batch(text, network=network, router='static')
+    fastest = list(csv.DictReader(io.StringIO(default)))
+    fixed = list(csv.DictReader(io.StringIO(static)))
+    for a, b in zip(fastest, fixed):
+        if a['status'] == b['status'] == 'ok':
+            assert int(a['travel_minutes']) <= int(b['travel_minutes']), a
+    # the fixed fastest-by-ride route waits 4 minutes longer here
+    _, out = _run_batch("from,to,time\nNew Ashok Nagar,Janakpuri East,18:34\n", network=network)
+    assert next(csv.DictReader(io.StringIO(out)))['travel_minutes'] == '50'
+
+
+# -------------------- name search --------------------
+def test_name_search_tiers(network):
+    index = metro.get_name_index(network.station_index)
+    assert metro.search_names(index, 'rajiv chowk') == [('Rajiv Chowk', 'exact', 0)]
+    assert metro.search_names(index, '  RAJIV ') == [('Rajiv Chowk', 'prefix', 0)]
+    found = metro.search_names(index, 'chowk', limit=3)
+    assert {kind for _, kind, _ in found} == {'substring'} and ('Rajiv Chowk', 'substring', 0) in found
+    assert metro.search_names(index, 'kashmir gate') == [('Kashmere Gate', 'fuzzy', 2)]
+    assert metro.search_names(index, 'kashmir gate', max_edits=0) == []
+    assert metro.search_names(index, 'zzzz') == []
+
+
+def test_name_search_fuzzy_prefix_and_line_typos(network):
+    index = metro.get_name_index(network.station_index)
+    names = [name for name, kind, edits in metro.search_names(index, 'rajev', fuzzy_prefix=True)
+             if kind == 'fuzzy' and edits == 1]
+    assert 'Rajiv Chowk' in names and 'Rajendra Place' in names
+    assert metro.find_best_line_match(network.lines, 'voilet line') == 'VIOLET LINE'
+    assert metro.find_best_line_match(network.lines, 'magenta line metro') == 'MAGENTA LINE'
+    assert metro.match_station(network, 'hauz') == 'Hauz Khas'
+    assert metro.match_station(network, 'hauz kas') is None
+
+
+def test_batch_csv_rows_keep_input_order_and_statuses(network):
+    rows, out = _run_batch("Kashmere Gate,Hauz Khas,09:00\nKashmere Gate,Nowhere,09:00\n"
+                           "Kashmere Gate,Hauz Khas,9am\nKashmere Gate,Hauz Khas,02:00\n", network=network)
+    records = list(csv.DictReader(io.StringIO(out)))
+    assert rows == 4
+    assert list(records[0]) == list(metro.BATCH_FIELDS)
+    assert [r['status'] for r in records] == ['ok', 'no_station', 'invalid_time', 'outside_hours']
+    plan = metro.plan_journey(network, 'Kashmere Gate', 'Hauz Khas', '09:00', router='timetable')
+    assert records[0]['travel_minutes'] == str(plan.travel_minutes)
+    assert records[0]['fare'] == str(plan.fare)
+
+
+def test_batch_jsonl_reports_malformed_rows(network):
+    text = '{"from": "kashmere", "to": "hauz", "time": "09:00"}\nnot json\n[1]\n'
+    rows, out = _run_batch(text, network=network, in_fmt='jsonl', out_fmt='jsonl')
+    records = [json.loads(line) for line in out.splitlines()]
+    assert rows == 3
+    assert [r['status'] for r in records] == ['ok', 'invalid_row', 'invalid_row']
+    assert records[0]['src'] == 'Kashmere Gate' and records[0]['dst'] == 'Hauz Khas'
+
+
+# -------------------- interchanges --------------------
+SMALL_NETWORK = """\
+[RED LINE]
+Info: Interchange_Time=Central:5, West:3
+Format: Station Name | Approx Time to Next | Interchange | Layout | Parking | Distance(km)
+West | 2 | - | Elevated | Yes | 1.0
+Central | 2 | Blue Line | Underground | No | 1.0
+East | 0 | Green Line | Elevated | No | 0
+
+[BLUE LINE]
+Format: Station Name | Approx Time to Next | Interchange | Layout | Parking | Distance(km)
+North | 2 | - | Elevated | Yes | 1.0
+Central | 2 | Red Line | Underground | No | 1.0
+South | 0 | Red Line | Elevated | No | 0
+
+[YELLOW LINE]
+Format: Station Name | Approx Time to Next | Interchange | Layout | Parking | Distance(km)
+Central | 3 | - | Underground | No | 2.0
+East | 0 | - | Elevated | No | 0
+"""
+
+
+def test_interchanges_resolve_tokens_and_flag_unbacked_transfers(tmp_path, capsys):
+    path = tmp_path / "metro_data.txt"
+    path.write_text(SMALL_NETWORK, encoding='utf-8')
+    network = metro.load_network(str(path))
+    ic = network.interchanges
+    assert ic.lines == {'Central': ('RED LINE', 'BLUE LINE', 'YELLOW LINE'), 'East': ('RED LINE', 'YELLOW LINE')}
+    assert ic.tokens[('RED LINE', 'Central')] == ('BLUE LINE',)
+    assert ic.tokens[('BLUE LINE', 'Central')] == ('RED LINE',)
+    assert metro.transfer_minutes(network, 'Central') == 5
+    assert metro.transfer_minutes(network, 'East') == metro.current_config().interchange
+    assert sorted(ic.warnings) == sorted([
+        "RED LINE: East lists 'Green Line', which is no line in the data file",
+        "RED LINE: Interchange_Time for West, which is no interchange",
+        "BLUE LINE: South lists 'Red Line', but RED LINE does not stop at South",
+        "Central: RED LINE and YELLOW LINE both stop here, but neither lists the other as an interchange",
+        "Central: BLUE LINE and YELLOW LINE both stop here, but neither lists the other as an interchange",
+        "East: RED LINE and YELLOW LINE both stop here, but neither lists the other as an interchange",
+    ])
+    assert metro.main_check(str(path)) == 1
+    out = capsys.readouterr().out
+    assert "Central: RED LINE, BLUE LINE, YELLOW LINE (5 min to change)" in out
+    assert "RED LINE lists BLUE LINE" in out
+    # the graph still joins every line at a shared station
+    graph = metro.get_station_graph(network)
+    assert (('YELLOW LINE', 'Central'), 5.0, 0.0, True) in graph[('RED LINE', 'Central')]
+
+
+# -------------------- headway optimizer --------------------
+@pytest.mark.parametrize("budget", [6, 10, 16])
+def test_headway_optimizer_matches_exhaustive_search(tmp_path, budget):
+    path = tmp_path / "metro_data.txt"
+    path.write_text(SMALL_NETWORK, encoding='utf-8')
+    network = metro.load_network(str(path))
+    choices = (3, 5, 8, 12)
+    plan = metro.optimize_headways(network, budget, choices=choices)
+    cycles = metro.line_cycles(network)
+    best = None
+    for picks in itertools.product(itertools.product(choices, repeat=2), repeat=len(cycles)):
+        fleet, wait, _, _ = metro.evaluate_headways(cycles, {lc.line: p for lc, p in zip(cycles, picks)})
+        if fleet <= budget and (best is None or wait < best):
+            best = wait
+    if best is None:
+        assert plan is None
+        return
+    assert plan.fleet <= budget
+    assert plan.avg_wait == pytest.approx(best)
+    assert (plan.fleet, plan.avg_wait) == metro.evaluate_headways(cycles, plan.headways)[:2]
+
+
+def test_headway_timetables_use_the_chosen_headways(network):
+    line = network.lines['YELLOW LINE']
+    timetables = metro.headway_timetables(network, {line.key: (3, 12)})
+    for towards_end in (True, False):
+        service = metro.line_service(line, towards_end)
+        expected = metro.build_departures(service._replace(peak_freq=3, offpeak_freq=12))
+        assert timetables[(line.key, towards_end)] == tuple(expected)
+    gaps = {round(b - a, 6) for a, b in zip(timetables[(line.key, True)], timetables[(line.key, True)][1:])}
+    assert {3, 12} <= gaps